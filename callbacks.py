@@ -1,5 +1,7 @@
 import time
 
+from policies import BackoffPolicy
+
 
 class Retriable:
     """
@@ -11,31 +13,38 @@ class Retriable:
         .not_retry_when(IndexError)
         .execute(estimator.fit)
     )
+
+    exceptions are matched with their subclasses, not_retry_when wins over retry_when
+    waits up to 2, 4, 8, ... seconds (full jitter) as default, pass a policies.BackoffPolicy for other delays, caps and retry budget
+    (exceptions of the policy are replaced by retry_when / not_retry_when)
     """
-    def __init__(self, max_tries: int):
+    def __init__(self, max_tries: int, policy: BackoffPolicy=None):
         self.max_tries = max_tries
+        self.policy = policy or BackoffPolicy(base=2, factor=2, jitter='full')
         self.exceptions = set()
-        
+        self.not_exceptions = set()
+
     def retry_when(self, *exceptions: Exception):
         self.exceptions.update(exceptions)
+        self.not_exceptions.difference_update(exceptions)
         return self
-      
+
     def not_retry_when(self, *exceptions: Exception):
         self.exceptions.difference_update(exceptions)
+        self.not_exceptions.update(exceptions)
         return self
-    
+
+    def should_retry(self, e: BaseException) -> bool:
+        return isinstance(e, tuple(self.exceptions)) and not isinstance(e, tuple(self.not_exceptions))
+
     def execute(self, f, *args, **kwargs):
         retry = 0
-        exc = None
-        while retry < self.max_tries:
+        delays = self.policy.delays()
+        while True:
             try:
                 return f(*args, **kwargs)
             except Exception as e:
-                exc = e
-                if type(e) in self.exceptions:
-                    retry += 1
-                    time.sleep(2 ** retry)
-                else:
-                    retry = max_retry
-        raise exc
-
+                retry += 1
+                if retry >= self.max_tries or not self.should_retry(e) or not self.policy.acquire():
+                    raise
+            time.sleep(next(delays))
@@ -1,13 +1,22 @@
 import re
+from functools import lru_cache, partial
+from multiprocessing import Pool
+from typing import Dict, Iterable, List, Match, Pattern, Tuple
+
+from convertors.registry import DEFAULT_UNITS, UnitRegistry, units_regex
 
 
 class ChineseUnit:
     CONVERT_METHODS = {
         '斤': lambda x: '{value}kg'.format(value=float(x) * 0.5),
-    }
+    }  # a UnitRegistry works as well, see ChineseMetricUnit
     RANGE_SELECTORS = [
         '-', '~'
     ]
+    # a unit followed by these is part of another word ('1克拉') or a numeral before a classifier ('一两个')
+    NOT_UNIT_FOLLOWERS = [
+        '拉', '个'
+    ]
 
     ORDINAL_NUMS = {
         '一': {'level': 1, 'value': 1},
@@ -25,49 +34,208 @@ class ChineseUnit:
         '千': {'level': 2, 'value': 10 ** 3},
 
         '万': {'level': 3, 'value': 10 ** 4},
-        '亿': {'level': 3, 'value': 10 ** 5},
+        '亿': {'level': 3, 'value': 10 ** 8},
         '兆': {'level': 3, 'value': 10 ** 6},
-        '万亿': {'level': 3, 'value': 10 ** 6},
+        '万亿': {'level': 3, 'value': 10 ** 12},
     }
 
     @classmethod
     def ordinal_to_cardinal(cls, string: str) -> int:
-        string = string.strip().replace(' ', '')
-        result = stack2 = stack1 = 0
-        last_level = 0
+        return _ordinal_to_cardinal(string.strip().replace(' ', ''), cls._ordinal_key())
+
+    @classmethod
+    def _ordinal_key(cls) -> Tuple[Tuple[str, int, int]]:
+        # caches are keyed on the contents of ORDINAL_NUMS, so that changes to it are picked up
+        return tuple((token, info['level'], info['value']) for token, info in cls.ORDINAL_NUMS.items())
+
+    @classmethod
+    def patterns(cls) -> Tuple[Pattern, Pattern]:
+        """
+        returns compiled (conversion, ordinal) patterns, they are recompiled only when units, ordinals or ranges change
+        """
+        return _compile_patterns(
+            tuple(cls.ORDINAL_NUMS), tuple(cls.RANGE_SELECTORS), units_regex(cls.CONVERT_METHODS), tuple(cls.NOT_UNIT_FOLLOWERS)
+        )
+
+    @classmethod
+    def convert(cls, string: str, search_start: int=0) -> str:
+        regex, ordinals = cls.patterns()
+        return string[:search_start] + regex.sub(partial(cls._convert_match, ordinals=ordinals, ordinal_key=cls._ordinal_key()), string[search_start:])
 
-        for char in string:
-            info = cls.ORDINAL_NUMS[char]
+    @classmethod
+    def extract(cls, string: str) -> List[Tuple[float, float, str]]:
+        """
+        returns numbers instead of formatted strings: [(lo, hi, unit), ...]
+        values are converted into the target unit of a UnitRegistry, plain dicts keep the source unit
+        a single value gives lo == hi
+        """
+        regex, ordinals = cls.patterns()
+        ordinal_key = cls._ordinal_key()
+        extracted = []
 
-            if info['level'] == last_level:
-                raise Exception(f"Invalid ordinal number: {string!r}")
+        for match in regex.finditer(string):
+            src_value1, _, src_value2, unit = match.groups()
+            try:
+                values = [cls._source_number(src_value, ordinals, ordinal_key) for src_value in [src_value1, src_value2] if src_value]
+                if isinstance(cls.CONVERT_METHODS, UnitRegistry):
+                    info = cls.CONVERT_METHODS.info(unit)
+                    values = [round(value * info['factor'], UnitRegistry.ROUND_DIGITS) for value in values]
+                    unit = info['target']
+            except Exception as e:
+                print(e)
             else:
-                last_level = info['level']
+                extracted.append((values[0], values[-1], unit))
 
-            if info['level'] == 3:
-                result += (stack2 + stack1 if stack2 + stack1 else 1) * info['value']
-                stack2 = stack1 = 0
+        return extracted
 
-            elif info['level'] == 2:
-                result += (stack1 if stack1 else 1) * info['value']
-                stack1 = 0
+    @classmethod
+    def convert_many(cls, strings: Iterable[str], processes: int=None, chunksize: int=256) -> List[str]:
+        """
+        converts repeated strings only once (memoized per call)
 
-            elif info['level'] == 1:
-                stack1 += info['value']
+        - processes
+            if given, unique strings are converted by a multiprocessing pool of that size
+        """
+        strings = list(strings)
+        uniques = list(dict.fromkeys(strings))
 
-            else:
-                raise Exception(f"Invalid ordinal level: {info['level']}")
+        if processes and processes > 1 and len(uniques) > chunksize:
+            with Pool(processes) as pool:
+                converted = pool.map(cls.convert, uniques, chunksize=chunksize)
+        else:
+            converted = list(map(cls.convert, uniques))
 
-        return result + stack2 + stack1
+        memo = dict(zip(uniques, converted))
+        return [memo[string] for string in strings]
 
     @classmethod
-    def convert(cls, string: str, search_start: int=0) -> str:
-        CARDINALS = '\d+\.*\d*'
-        ORDINALS = f"[{'|'.join(cls.ORDINAL_NUMS)}][{'|'.join(cls.ORDINAL_NUMS)}|\s]*"
+    def convert_series(cls, series: 'pandas.Series') -> 'pandas.Series':
+        """
+        pandas version of convert_many: unique values are converted by Series.str.replace, missing values are kept
+        """
+        # following module: pip install pandas
+        import pandas as pd
+
+        codes, uniques = pd.factorize(series)
+        regex, ordinals = cls.patterns()
+        converted = pd.Series(uniques).str.replace(regex, partial(cls._convert_match, ordinals=ordinals, ordinal_key=cls._ordinal_key()), regex=True)
+        return pd.Series(converted.to_numpy().take(codes), index=series.index, name=series.name).where(codes >= 0)
+
+    @classmethod
+    def _source_number(cls, src_value: str, ordinals: Pattern, ordinal_key: Tuple) -> float:
+        if ordinals.search(src_value):
+            return _ordinal_to_cardinal(src_value.strip().replace(' ', ''), ordinal_key)
+        return float(src_value)
+
+    @classmethod
+    def _convert_match(cls, match: Match, ordinals: Pattern, ordinal_key: Tuple) -> str:
+        src_value1, range_selector, src_value2, unit = match.groups()
+
+        try:
+            dst_values = []
+
+            for src_value in [src_value1, src_value2]:
+                if src_value:
+                    if ordinals.search(src_value):
+                        src_value = _ordinal_to_cardinal(src_value.strip().replace(' ', ''), ordinal_key)
+                    dst_value = cls.CONVERT_METHODS[unit](src_value)
+                else:
+                    dst_value = ''
+                dst_values.append(dst_value)
+
+            return str((range_selector if range_selector else '').join(dst_values))
+
+        except Exception as e:
+            print(e)
+            return match.group(0)
+
+
+@lru_cache(maxsize=32)
+def _ordinal_table(ordinals: Tuple[Tuple[str, int, int]]) -> Tuple[Dict[str, Tuple[int, int]], int]:
+    table = {token: (level, value) for token, level, value in ordinals}
+    return table, max(map(len, table))
+
+
+@lru_cache(maxsize=4096)
+def _ordinal_to_cardinal(string: str, ordinals: Tuple[Tuple[str, int, int]]) -> int:
+    table, max_length = _ordinal_table(ordinals)
+    result = section = digit = 0
+    last_level = last_large = 0
+    position = 0
+
+    while position < len(string):
+        # longest token first, so that multi-char numerals such as '万亿' match
+        for length in range(min(max_length, len(string) - position), 0, -1):
+            token = string[position : position + length]
+            if token in table:
+                level, value = table[token]
+                position += length
+                break
+        else:
+            raise KeyError(string[position])
+
+        if level == last_level:
+            raise Exception(f"Invalid ordinal number: {string!r}")
+        else:
+            last_level = level
+
+        if level == 3:
+            amount = section + digit
+            if result and value > last_large:
+                result = (result + amount) * value  # e.g. '三万五千亿'
+            else:
+                result += (amount if amount else 1) * value
+            last_large = value
+            section = digit = 0
+
+        elif level == 2:
+            section += (digit if digit else 1) * value
+            digit = 0
+
+        elif level == 1:
+            digit = value
+
+        else:
+            raise Exception(f"Invalid ordinal level: {level}")
+
+    return result + section + digit
+
+
+@lru_cache(maxsize=32)
+def _compile_patterns(ordinal_nums: Tuple[str], range_selectors: Tuple[str], units: str, not_unit_followers: Tuple[str]) -> Tuple[Pattern, Pattern]:
+    CARDINALS = r'\d+\.*\d*'
+    ORDINALS = rf"[{'|'.join(ordinal_nums)}][{'|'.join(ordinal_nums)}|\s]*"
+    RANGES = f"[{'|'.join(range_selectors)}]"
+    # no match from the middle of a number ('5千克' is not '5' + '千克'), a second value needs a range selector
+    NUMBER_START = rf"(?<![\d.{re.escape(''.join(ordinal_nums))}])"
+    UNIT_END = rf"(?![{re.escape(''.join(not_unit_followers))}])" if not_unit_followers else ''
+
+    regex = rf"{NUMBER_START}({CARDINALS}|{ORDINALS})(?:\s*({RANGES})\s*({CARDINALS}|{ORDINALS}))?\s*({units}){UNIT_END}"
+    return re.compile(regex), re.compile(ORDINALS)
+
+
+class ChineseMetricUnit(ChineseUnit):
+    """
+    ChineseUnit converting the mass, length and volume units of convertors.registry.DEFAULT_UNITS
+    """
+    CONVERT_METHODS = DEFAULT_UNITS
+
+
+if __name__ == "__main__":
+    import random
+    import sys
+    import time
+
+    import pandas as pd
+
+    def recursive_convert(cls, string: str, search_start: int=0) -> str:
+        # previous implementation: rebuilds the regex and recurses once per match
+        CARDINALS = r'\d+\.*\d*'
+        ORDINALS = rf"[{'|'.join(cls.ORDINAL_NUMS)}][{'|'.join(cls.ORDINAL_NUMS)}|\s]*"
         RANGES = f"[{'|'.join(cls.RANGE_SELECTORS)}]"
         UNITS = f"{'|'.join(cls.CONVERT_METHODS)}"
-        
-        regex = f"({CARDINALS}|{ORDINALS})\s*({RANGES})*\s*({CARDINALS}|{ORDINALS})*\s*({UNITS})"
+
+        regex = rf"({CARDINALS}|{ORDINALS})\s*({RANGES})*\s*({CARDINALS}|{ORDINALS})*\s*({UNITS})"
         search_string = string[search_start:]
         search_result = re.search(regex, search_string)
 
@@ -99,4 +267,68 @@ class ChineseUnit:
         else:
             search_start += start + len(str(dst_value))
 
-        return cls.convert(string, search_start)
+        return recursive_convert(cls, string, search_start)
+
+    assert ChineseUnit.convert('苹果 5斤, 梨 三-五斤, 葡萄 1.5 ~ 2斤') == '苹果 2.5kg, 梨 1.5kg-2.5kg, 葡萄 0.75kg~1.0kg'
+    assert ChineseMetricUnit.convert('绳子 30厘米, 水 2升, 茶叶 3两') == '绳子 0.3m, 水 2.0L, 茶叶 0.15kg'
+    assert ChineseMetricUnit.extract('梨 三-五斤, 绳子 30厘米') == [(1.5, 2.5, 'kg'), (0.3, 0.3, 'm')]
+    assert ChineseUnit.extract('梨 三-五斤') == [(3, 5, '斤')]
+    for string in ['5千克', '2千米', '1克拉钻戒', '一两个苹果', '5万斤']:
+        assert ChineseUnit.convert(string) == string and ChineseUnit.extract(string) == []
+    assert ChineseMetricUnit.convert('5千克, 2千米, 三千克') == '5.0kg, 2000.0m, 3.0kg'
+    assert ChineseMetricUnit.extract('5千克') == [(5.0, 5.0, 'kg')]
+    for string in ['1克拉钻戒', '一两个苹果', '5万斤']:
+        assert ChineseMetricUnit.convert(string) == string and ChineseMetricUnit.extract(string) == []
+    assert ChineseUnit.ordinal_to_cardinal('三千万') == 3 * 10 ** 7
+    assert ChineseUnit.ordinal_to_cardinal('二十三') == 23 and ChineseUnit.ordinal_to_cardinal('十') == 10
+    assert ChineseUnit.ordinal_to_cardinal('五万亿') == ChineseUnit.ordinal_to_cardinal('五万 亿') == 5 * 10 ** 12
+    assert ChineseUnit.ordinal_to_cardinal('三亿五千万') == 35 * 10 ** 7
+
+    class ExtendedUnit(ChineseUnit):
+        ORDINAL_NUMS = dict(ChineseUnit.ORDINAL_NUMS)
+
+    assert ExtendedUnit.ordinal_to_cardinal('三千') == 3000 and ExtendedUnit.convert('两千斤') == '两500.0kg'
+    ExtendedUnit.ORDINAL_NUMS['两'] = {'level': 1, 'value': 2}  # caches follow in-place changes
+    assert ExtendedUnit.ordinal_to_cardinal('两千') == 2000 and ExtendedUnit.convert('两千斤') == '1000.0kg'
+
+    random.seed(0)
+    samples = ['5斤', '三斤', '二十 - 三十斤', '1.5~2斤', '大', '包邮 ', '新鲜水果', '七百斤']
+    strings = []
+    for _ in range(10):
+        parts = []
+        while sum(map(len, parts)) < 10000:
+            parts.append(random.choice(samples))
+        strings.append(''.join(parts))
+
+    sys.setrecursionlimit(100000)  # the previous implementation recurses once per match
+    ts = time.perf_counter()
+    expected = [recursive_convert(ChineseUnit, string) for string in strings]
+    recursive_elapsed = time.perf_counter() - ts
+
+    ts = time.perf_counter()
+    converted = [ChineseUnit.convert(string) for string in strings]
+    single_pass_elapsed = time.perf_counter() - ts
+
+    assert converted == expected
+    n_units = sum(len(ChineseUnit.patterns()[0].findall(string)) for string in strings) // len(strings)
+    print(f"10k chars, ~{n_units} units per string")
+    print(f"recursive: {recursive_elapsed / len(strings) * 1e3:.2f} ms, single pass: {single_pass_elapsed / len(strings) * 1e3:.2f} ms ({recursive_elapsed / single_pass_elapsed:.1f}x)")
+
+    titles = [random.choice(samples) + random.choice(samples) for _ in range(200000)]
+    series = pd.Series(titles + [None])
+
+    ts = time.perf_counter()
+    expected = series.iloc[:-1].apply(ChineseUnit.convert).tolist()
+    apply_elapsed = time.perf_counter() - ts
+
+    ts = time.perf_counter()
+    converted = ChineseUnit.convert_many(titles)
+    many_elapsed = time.perf_counter() - ts
+
+    ts = time.perf_counter()
+    converted_series = ChineseUnit.convert_series(series)
+    series_elapsed = time.perf_counter() - ts
+
+    assert converted == expected == converted_series.iloc[:-1].tolist() and pd.isna(converted_series.iloc[-1])
+    assert ChineseUnit.convert_many(titles[:1000], processes=2, chunksize=8) == expected[:1000]
+    print(f"{len(titles):,} titles: Series.apply {apply_elapsed:.2f} s, convert_many {many_elapsed:.2f} s, convert_series {series_elapsed:.2f} s")
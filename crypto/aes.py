@@ -1,6 +1,11 @@
 import base64
 import hashlib
+import itertools
+import struct
+import time
+from functools import partial
 from random import randint
+from typing import BinaryIO, Iterable, Iterator, Tuple
 
 # following module: pip install pycryptodome
 from Crypto import Random
@@ -14,26 +19,116 @@ from Crypto.Cipher import AES
 SECRET_KEY = 'secret'
 SECRET_SEP = b'@..'  # too simple seperator can cause exception in decrpyt function: .split()
 
+# binary envelope: [magic, version, mode, nonce length, tag length] + nonce + tag + ciphertext
+# tokens written with SECRET_SEP (legacy format) are still detected and readable
+ENVELOPE_MAGIC = b'\xa5\x1e'  # not in the base64 alphabet, so raw and base64 envelopes are distinguishable
+ENVELOPE_VERSION = 1
+ENVELOPE_HEADER = struct.Struct('>2sBBBB')
+
 
 def make_key(secret_key: str) -> bytes:
     return hashlib.sha256(secret_key.encode('utf-8')).digest()
 
 
-def pad(x: str, variance: int=None) -> str:
+def pad(x: bytes, variance: int=None) -> bytes:
     if variance is None:
         variance = randint(1, 100)
     value = variance - len(x) % variance
-    return x + chr(value) * value
+    return x + bytes([value]) * value
 
 
 def unpad(x: bytes) -> bytes:
     return x[:-x[-1]]
 
 
-class AESCipher_CBC:
+class _AESCipherBase:
+    """
+    * seal(key, data, associated_data) -> (ciphertext, tag, nonce): encrypts bytes with an already derived key,
+      associated_data is authenticated but not stored, unseal must be given the same
+    * unseal(key, ciphertext, tag, nonce, associated_data) -> data: decrypts bytes with an already derived key
+    * pack / unpack: (de)serializes the sealed parts into the stored token (see ENVELOPE_HEADER)
+    """
+    BS = 16
+    MODE = None
+    ENVELOPE_MODE = None  # mode id in the envelope header, unique per class
+
+    @classmethod
+    def encrypt(cls, raw, b64: bool=False):
+        return cls.pack(*cls.seal(make_key(SECRET_KEY), raw.encode()), b64=b64)
+
+    @classmethod
+    def decrypt(cls, enc):
+        return cls.unseal(make_key(SECRET_KEY), *cls.unpack(enc)).decode()
+
+    @classmethod
+    def seal(cls, key: bytes, data: bytes, associated_data: bytes=b'') -> Tuple[bytes, bytes, bytes]:
+        nonce = Random.get_random_bytes(cls.BS)
+        cipher = AES.new(key, cls.MODE, nonce=nonce)
+        if associated_data:
+            cipher.update(associated_data)
+        ciphertext, tag = cipher.encrypt_and_digest(pad(data))
+        return ciphertext, tag, nonce
+
+    @classmethod
+    def unseal(cls, key: bytes, ciphertext: bytes, tag: bytes, nonce: bytes, associated_data: bytes=b'') -> bytes:
+        cipher = AES.new(key, cls.MODE, nonce=nonce)
+        if associated_data:
+            cipher.update(associated_data)
+        return unpad(cipher.decrypt_and_verify(ciphertext, tag))
+
+    @classmethod
+    def pack(cls, ciphertext: bytes, tag: bytes, nonce: bytes, b64: bool=False) -> bytes:
+        header = ENVELOPE_HEADER.pack(ENVELOPE_MAGIC, ENVELOPE_VERSION, cls.ENVELOPE_MODE, len(nonce), len(tag))
+        envelope = b''.join([header, nonce, tag, ciphertext])
+        return base64.b64encode(envelope) if b64 else envelope
+
+    @classmethod
+    def unpack(cls, enc) -> Tuple[memoryview, memoryview, memoryview]:
+        """
+        accepts binary envelopes, base64 envelopes and legacy (separator-split) tokens
+        """
+        if isinstance(enc, str):
+            enc = enc.encode('ascii')
+        view = memoryview(enc)
+        if view[:len(ENVELOPE_MAGIC)] != ENVELOPE_MAGIC:
+            view = memoryview(base64.b64decode(enc))
+            if view[:len(ENVELOPE_MAGIC)] != ENVELOPE_MAGIC:
+                return cls.unpack_legacy(view.tobytes())
+        try:
+            return cls.parse_envelope(view)
+        except ValueError as error:
+            # a legacy token may start with the magic by chance, otherwise the envelope error is the relevant one
+            try:
+                return cls.unpack_legacy(view.tobytes())
+            except ValueError:
+                raise error from None
+
+    @classmethod
+    def parse_envelope(cls, view: memoryview) -> Tuple[memoryview, memoryview, memoryview]:
+        if len(view) < ENVELOPE_HEADER.size:
+            raise ValueError(f"Envelope too short: {len(view)} bytes")
+        _, version, mode, nonce_len, tag_len = ENVELOPE_HEADER.unpack_from(view)
+        if version != ENVELOPE_VERSION:
+            raise ValueError(f"Unsupported envelope version: {version}")
+        if mode != cls.ENVELOPE_MODE:
+            raise ValueError(f"Envelope mode mismatch: {mode} (expected {cls.ENVELOPE_MODE})")
+        nonce_start = ENVELOPE_HEADER.size
+        tag_start = nonce_start + nonce_len
+        ciphertext_start = tag_start + tag_len
+        if len(view) < ciphertext_start:
+            raise ValueError(f"Envelope too short: {len(view)} bytes")
+        return view[ciphertext_start:], view[tag_start:ciphertext_start], view[nonce_start:tag_start]
+
+    @classmethod
+    def unpack_legacy(cls, blob: bytes) -> Tuple[bytes, bytes, bytes]:
+        ciphertext, tag, nonce = blob.split(SECRET_SEP)
+        return ciphertext, tag, nonce
+
+
+class AESCipher_CBC(_AESCipherBase):
     """
     AES-128
-    
+
     Example:
         raw = '1234567890'
         print(f"raw: {raw}")
@@ -47,22 +142,31 @@ class AESCipher_CBC:
         assert raw == decrpyted
     """
     BS = 16
+    MODE = AES.MODE_CBC
+    ENVELOPE_MODE = AES.MODE_CBC
 
     @classmethod
-    def encrypt(cls, raw):
+    def seal(cls, key: bytes, data: bytes, associated_data: bytes=b'') -> Tuple[bytes, bytes, bytes]:
+        if associated_data:
+            raise ValueError(f"{cls.__name__} is not authenticated, associated data cannot be bound")
         iv = Random.get_random_bytes(cls.BS)
-        cipher = AES.new(make_key(SECRET_KEY), AES.MODE_CBC, iv=iv)
-        ciphertext = cipher.encrypt(pad(raw, cls.BS).encode())
-        return base64.b64encode(SECRET_SEP.join([ciphertext, iv]))
+        cipher = AES.new(key, cls.MODE, iv=iv)
+        return cipher.encrypt(pad(data, cls.BS)), b'', iv
 
     @classmethod
-    def decrypt(cls, enc):
-        ciphertext, iv = base64.b64decode(enc).split(SECRET_SEP)
-        cipher = AES.new(make_key(SECRET_KEY), AES.MODE_CBC, iv=iv)
-        return unpad(cipher.decrypt(ciphertext)).decode()
+    def unseal(cls, key: bytes, ciphertext: bytes, tag: bytes, iv: bytes, associated_data: bytes=b'') -> bytes:
+        if associated_data:
+            raise ValueError(f"{cls.__name__} is not authenticated, associated data cannot be bound")
+        cipher = AES.new(key, cls.MODE, iv=iv)
+        return unpad(cipher.decrypt(ciphertext))
+
+    @classmethod
+    def unpack_legacy(cls, blob: bytes) -> Tuple[bytes, bytes, bytes]:
+        ciphertext, iv = blob.split(SECRET_SEP)
+        return ciphertext, b'', iv
 
 
-class AESCipher_EAX:
+class AESCipher_EAX(_AESCipherBase):
     """
     AES-128
 
@@ -80,22 +184,11 @@ class AESCipher_EAX:
         assert raw == decrpyted
     """
     BS = 16
-
-    @classmethod
-    def encrypt(cls, raw):
-        nonce = Random.get_random_bytes(cls.BS)
-        cipher = AES.new(make_key(SECRET_KEY), AES.MODE_EAX, nonce=nonce)
-        ciphertext, tag = cipher.encrypt_and_digest(pad(raw).encode())
-        return base64.b64encode(SECRET_SEP.join([ciphertext, tag, nonce]))
-
-    @classmethod
-    def decrypt(cls, enc):
-        ciphertext, tag, nonce = base64.b64decode(enc).split(SECRET_SEP)
-        cipher = AES.new(make_key(SECRET_KEY), AES.MODE_EAX, nonce=nonce)
-        return unpad(cipher.decrypt_and_verify(ciphertext, tag)).decode()
+    MODE = AES.MODE_EAX
+    ENVELOPE_MODE = AES.MODE_EAX
 
 
-class AESCipher_SIV:
+class AESCipher_SIV(_AESCipherBase):
     """
     AES-256
 
@@ -113,16 +206,231 @@ class AESCipher_SIV:
         assert raw == decrpyted
     """
     BS = 32
+    MODE = AES.MODE_SIV
+    ENVELOPE_MODE = AES.MODE_SIV
+
+
+class AESCipher_DSIV(AESCipher_SIV):
+    """
+    deterministic AES-SIV: no nonce and fixed padding, so equal plaintexts give equal tokens
+    this reveals which values are equal, use it only for fields that must be joined or searched (see crypto.index)
+
+    Example:
+
+        raw = 'someone@example.com'
+        assert AESCipher_DSIV.encrypt(raw) == AESCipher_DSIV.encrypt(raw)
+        assert AESCipher_DSIV.decrypt(AESCipher_DSIV.encrypt(raw)) == raw
+    """
+    ENVELOPE_MODE = 0x80 | AES.MODE_SIV  # same cipher mode, but tokens must not pass for randomized SIV ones
 
     @classmethod
-    def encrypt(cls, raw):
-        nonce = Random.get_random_bytes(cls.BS)
-        cipher = AES.new(make_key(SECRET_KEY), AES.MODE_SIV, nonce=nonce)
-        ciphertext, tag = cipher.encrypt_and_digest(pad(raw).encode())
-        return base64.b64encode(SECRET_SEP.join([ciphertext, tag, nonce]))
+    def seal(cls, key: bytes, data: bytes, associated_data: bytes=b'') -> Tuple[bytes, bytes, bytes]:
+        cipher = AES.new(key, cls.MODE)
+        if associated_data:
+            cipher.update(associated_data)
+        ciphertext, tag = cipher.encrypt_and_digest(pad(data, cls.BS))
+        return ciphertext, tag, b''
 
     @classmethod
-    def decrypt(cls, enc):
-        ciphertext, tag, nonce = base64.b64decode(enc).split(SECRET_SEP)
-        cipher = AES.new(make_key(SECRET_KEY), AES.MODE_SIV, nonce=nonce)
-        return unpad(cipher.decrypt_and_verify(ciphertext, tag)).decode()
+    def unseal(cls, key: bytes, ciphertext: bytes, tag: bytes, nonce: bytes, associated_data: bytes=b'') -> bytes:
+        if len(nonce):
+            raise ValueError(f"{cls.__name__} tokens have no nonce, got {len(nonce)} bytes")
+        cipher = AES.new(key, cls.MODE)
+        if associated_data:
+            cipher.update(associated_data)
+        return unpad(cipher.decrypt_and_verify(ciphertext, tag))
+
+
+class AESCipher:
+    """
+    cipher object which derives the key only once, for bulk and stream encryption
+    tokens are compatible with the classmethods of the given method (AESCipher_CBC, AESCipher_EAX, AESCipher_SIV, AESCipher_DSIV)
+
+    - b64
+        if False (as default), tokens are raw binary envelopes (smallest, for bytes/BLOB columns)
+        if True, tokens are base64 encoded envelopes (safe to store as text, a third larger)
+        decryption accepts both, as well as legacy tokens
+
+    - stream format
+        the source is read in chunks of `chunk_size` bytes and every chunk is sealed independently,
+        so neither side holds more than one chunk in memory
+        frame: envelope length (big endian uint32) + last flag (uint8) + binary envelope
+        the chunk index and the last flag are authenticated as associated data, so reordered, duplicated or
+        dropped frames and a stream cut before its last frame fail to decrypt (needs EAX, SIV or DSIV, not CBC)
+
+    Example:
+
+        cipher = AESCipher(AESCipher_EAX)
+
+        encrypted = list(cipher.encrypt_many(['a', 'b', 'c']))
+        decrypted = list(cipher.decrypt_many(encrypted))
+        assert decrypted == ['a', 'b', 'c']
+
+        with open('plain.bin', 'rb') as src, open('encrypted.bin', 'wb') as dst:
+            cipher.encrypt_stream(src, dst)
+    """
+    CHUNK_SIZE = 64 * 1024
+    FRAME_HEADER = struct.Struct('>IB')
+    FRAME_AAD = struct.Struct('>QB')  # chunk index, last flag
+
+    def __init__(self, method: type=AESCipher_EAX, secret_key: str=SECRET_KEY, b64: bool=False):
+        self.method = method
+        self.b64 = b64
+        self._key = make_key(secret_key)
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(method={self.method.__name__}, b64={self.b64})"
+
+    def encrypt(self, raw: str) -> bytes:
+        return self.method.pack(*self.method.seal(self._key, raw.encode()), b64=self.b64)
+
+    def decrypt(self, enc) -> str:
+        return self.method.unseal(self._key, *self.method.unpack(enc)).decode()
+
+    def encrypt_many(self, raws: Iterable[str]) -> Iterator[bytes]:
+        return map(self.encrypt, raws)
+
+    def decrypt_many(self, encs: Iterable) -> Iterator[str]:
+        return map(self.decrypt, encs)
+
+    def encrypt_stream(self, src: BinaryIO, dst: BinaryIO, chunk_size: int=None) -> int:
+        """
+        returns the number of bytes written to dst
+        """
+        written = 0
+        chunks = iter(partial(src.read, chunk_size or self.CHUNK_SIZE), b'')
+        chunk = next(chunks, b'')  # an empty source still gets its last frame
+        for index in itertools.count():
+            following = next(chunks, None)
+            last = following is None
+            sealed = self.method.seal(self._key, chunk, self.FRAME_AAD.pack(index, last))
+            envelope = self.method.pack(*sealed, b64=False)
+            dst.write(self.FRAME_HEADER.pack(len(envelope), last))
+            dst.write(envelope)
+            written += self.FRAME_HEADER.size + len(envelope)
+            if last:
+                return written
+            chunk = following
+
+    def decrypt_stream(self, src: BinaryIO, dst: BinaryIO) -> int:
+        """
+        returns the number of bytes written to dst
+        """
+        written = 0
+        last = False
+        for index, header in enumerate(iter(partial(src.read, self.FRAME_HEADER.size), b'')):
+            if last:
+                raise ValueError(f"Frame {index} after the last frame")
+            if len(header) != self.FRAME_HEADER.size:
+                raise ValueError(f"Truncated stream: expected {self.FRAME_HEADER.size} bytes, got {len(header)}")
+            size, last = self.FRAME_HEADER.unpack(header)
+            envelope = memoryview(self._read_exactly(src, size))
+            # a moved, repeated or reflagged frame fails the tag check
+            chunk = self.method.unseal(self._key, *self.method.parse_envelope(envelope), self.FRAME_AAD.pack(index, last))
+            dst.write(chunk)
+            written += len(chunk)
+        if not last:
+            raise ValueError('Truncated stream: no last frame')
+        return written
+
+    @staticmethod
+    def _read_exactly(src: BinaryIO, size: int) -> bytes:
+        data = src.read(size)
+        if len(data) != size:
+            raise ValueError(f"Truncated stream: expected {size} bytes, got {len(data)}")
+        return data
+
+
+if __name__ == "__main__":
+    import io
+
+    n_records = 20000
+    raws = [f"user{i:08d}@example.com" for i in range(n_records)]
+
+    for method in (AESCipher_CBC, AESCipher_EAX, AESCipher_SIV, AESCipher_DSIV):
+        cipher = AESCipher(method)
+
+        ts = time.perf_counter()
+        encrypted = [method.encrypt(raw) for raw in raws]
+        decrypted = [method.decrypt(enc) for enc in encrypted]
+        classmethod_rps = n_records / (time.perf_counter() - ts)
+        assert decrypted == raws
+
+        ts = time.perf_counter()
+        encrypted = list(cipher.encrypt_many(raws))
+        decrypted = list(cipher.decrypt_many(encrypted))
+        object_rps = n_records / (time.perf_counter() - ts)
+        assert decrypted == raws
+
+        # tokens are interchangeable between the classmethods and the cipher object
+        assert method.decrypt(cipher.encrypt(raws[0])) == cipher.decrypt(method.encrypt(raws[0])) == raws[0]
+        assert cipher.decrypt(method.encrypt(raws[0], b64=True)) == raws[0]  # opt-in base64 tokens stay readable
+
+        for other in (AESCipher_CBC, AESCipher_EAX, AESCipher_SIV, AESCipher_DSIV):
+            if other is not method:
+                try:
+                    method.decrypt(other.encrypt(raws[0]))
+                except ValueError as e:
+                    assert 'mode mismatch' in str(e), e
+                else:
+                    raise AssertionError(f"{method.__name__} decrypted a {other.__name__} token")
+
+        print(f"{method.__name__}: classmethod {classmethod_rps:,.0f} rec/s, AESCipher {object_rps:,.0f} rec/s ({object_rps / classmethod_rps:.2f}x)")
+
+        if method is AESCipher_DSIV:
+            continue  # no legacy format
+
+        # legacy tokens are still readable, envelopes are smaller
+        # (random bytes forming SECRET_SEP make unreadable legacy tokens, such samples are sealed again)
+        def seal_legacy(raw):
+            parts = [part for part in method.seal(make_key(SECRET_KEY), raw.encode()) if part]
+            blob = SECRET_SEP.join(parts)
+            return seal_legacy(raw) if blob.count(SECRET_SEP) != len(parts) - 1 else blob
+
+        legacy_blobs = [seal_legacy(raw) for raw in raws[:1000]]
+        legacy = [base64.b64encode(blob) for blob in legacy_blobs]
+        sealed = [method.unpack_legacy(blob) for blob in legacy_blobs]
+        assert [method.decrypt(enc) for enc in legacy] == raws[:1000]
+        b64_size = sum(len(method.pack(*parts, b64=True)) for parts in sealed)
+        binary_size = sum(len(method.pack(*parts)) for parts in sealed)
+        legacy_size = sum(map(len, legacy))
+        print(f"{method.__name__}: legacy {legacy_size:,} bytes, b64 envelope {b64_size:,} bytes, binary envelope {binary_size:,} bytes")
+
+    payload = Random.get_random_bytes(1024 * 1024 + 7)
+    src, encrypted, decrypted = io.BytesIO(payload), io.BytesIO(), io.BytesIO()
+    cipher = AESCipher(AESCipher_EAX)
+    cipher.encrypt_stream(src, encrypted, chunk_size=4096)
+    encrypted.seek(0)
+    cipher.decrypt_stream(encrypted, decrypted)
+    assert decrypted.getvalue() == payload
+    print(f"stream: {len(payload)} bytes -> {len(encrypted.getvalue())} bytes")
+
+    # frames are bound to their position: reordered, duplicated, dropped or cut-off frames do not decrypt
+    frames, view = [], encrypted.getvalue()
+    while view:
+        size, _ = AESCipher.FRAME_HEADER.unpack_from(view)
+        end = AESCipher.FRAME_HEADER.size + size
+        frames, view = frames + [view[:end]], view[end:]
+    tampered = {
+        'reordered': [frames[1], frames[0]] + frames[2:],
+        'duplicated': frames[:2] + frames[1:],
+        'dropped': frames[:1] + frames[2:],
+        'cut at a frame boundary': frames[:-1],
+        'appended': frames + frames[-1:],
+    }
+    for name, parts in tampered.items():
+        try:
+            cipher.decrypt_stream(io.BytesIO(b''.join(parts)), io.BytesIO())
+        except ValueError:
+            pass
+        else:
+            raise AssertionError(f"{name} frames decrypted")
+    empty = io.BytesIO()
+    cipher.encrypt_stream(io.BytesIO(), empty)
+    assert cipher.decrypt_stream(io.BytesIO(empty.getvalue()), io.BytesIO()) == 0
+    try:
+        AESCipher(AESCipher_CBC).encrypt_stream(io.BytesIO(payload), io.BytesIO())
+    except ValueError:
+        pass
+    else:
+        raise AssertionError('CBC streams cannot be authenticated')
@@ -0,0 +1,90 @@
+import time
+from collections import defaultdict
+from typing import Any, Hashable, Iterable, List
+
+from crypto.aes import AESCipher, AESCipher_DSIV, AESCipher_SIV
+
+
+class EncryptedIndex:
+    """
+    in-memory hash index from deterministic ciphertext to row ids
+    equality search costs one encryption and one dict lookup, instead of decrypting every row
+
+    tokens are keyed by their (tag, ciphertext), so base64 and binary envelopes of the same value match
+
+    Example:
+
+        cipher = AESCipher(AESCipher_DSIV)
+        df['email_enc'] = list(cipher.encrypt_many(df['email']))
+
+        index = EncryptedIndex.build(cipher, df['email_enc'], df.index)
+        rows = df.loc[index.lookup('someone@example.com')]
+    """
+    def __init__(self, cipher: AESCipher):
+        assert issubclass(cipher.method, AESCipher_DSIV), 'Argument "cipher" should use a deterministic method (AESCipher_DSIV)'
+        self.cipher = cipher
+        self._rows = defaultdict(list)
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(cipher={self.cipher!r}, keys={len(self)})"
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __contains__(self, raw: str) -> bool:
+        return self._key(self.cipher.encrypt(raw)) in self._rows
+
+    @classmethod
+    def build(cls, cipher: AESCipher, tokens: Iterable, row_ids: Iterable[Hashable]=None) -> 'EncryptedIndex':
+        """
+        if row_ids is None, positions of tokens are used as row ids
+        """
+        index = cls(cipher)
+        for row_id, token in (enumerate(tokens) if row_ids is None else zip(row_ids, tokens)):
+            index.add(token, row_id)
+        return index
+
+    def add(self, token, row_id: Hashable):
+        self._rows[self._key(token)].append(row_id)
+
+    def lookup(self, raw: str) -> List[Any]:
+        return list(self._rows.get(self._key(self.cipher.encrypt(raw)), ()))
+
+    def lookup_token(self, token) -> List[Any]:
+        return list(self._rows.get(self._key(token), ()))
+
+    def _key(self, token) -> bytes:
+        ciphertext, tag, nonce = self.cipher.method.unpack(token)
+        if len(nonce):
+            raise ValueError(f"Token has a {len(nonce)}-byte nonce: randomized tokens can never be matched")
+        return bytes(tag) + bytes(ciphertext)
+
+
+if __name__ == "__main__":
+    n_rows = 20000
+    cipher = AESCipher(AESCipher_DSIV)
+    emails = [f"user{i % 5000:08d}@example.com" for i in range(n_rows)]
+    tokens = list(cipher.encrypt_many(emails))
+    target = emails[1234]
+
+    ts = time.perf_counter()
+    scanned = [row_id for row_id, token in enumerate(tokens) if cipher.decrypt(token) == target]
+    scan_elapsed = time.perf_counter() - ts
+
+    ts = time.perf_counter()
+    index = EncryptedIndex.build(cipher, tokens)
+    build_elapsed = time.perf_counter() - ts
+
+    ts = time.perf_counter()
+    found = index.lookup(target)
+    lookup_elapsed = time.perf_counter() - ts
+
+    assert found == scanned == [1234, 6234, 11234, 16234]
+    try:
+        index.add(AESCipher_SIV.encrypt(target), -1)
+    except ValueError:
+        pass
+    else:
+        raise AssertionError('randomized SIV tokens should be rejected')
+    print(f"full-scan decrypt: {scan_elapsed * 1e3:,.1f} ms")
+    print(f"index build: {build_elapsed * 1e3:,.1f} ms (once), lookup: {lookup_elapsed * 1e6:,.1f} us ({scan_elapsed / lookup_elapsed:,.0f}x)")
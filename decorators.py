@@ -2,16 +2,34 @@ import time
 import sys
 import traceback
 import asyncio
+import inspect
+import threading
+import contextvars
+import weakref
+from collections import OrderedDict, defaultdict, deque, namedtuple
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
 from functools import wraps, partial
 from enum import Enum
 from typing import *
 
+from policies import BackoffPolicy
+
 
 def dummy_return(value: Any):
     """
     if the func raises exception, returns dummy value
     """
     def decorator(func):
+
+        if asyncio.iscoroutinefunction(func):
+            @wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                try:
+                    return await func(*args, **kwargs)
+                except Exception:
+                    return value
+
+            return async_wrapper
         
         @wraps(func)
         def wrapper(*args, **kwargs):
@@ -26,9 +44,10 @@ def dummy_return(value: Any):
     return decorator
 
 
-def retry(tries: int, wait: (int or float), exp: bool=False, info_level: int=2, **kwargs):
+def retry(tries: int, wait: (int or float), exp: bool=False, info_level: int=2, deadline: (int or float)=None, policy: BackoffPolicy=None, **kwargs):
     """
     func tries up to designated tries
+    coroutine functions are retried as well, awaiting the backoff without blocking the event loop
 
     - info_level
         0: no info served
@@ -36,46 +55,131 @@ def retry(tries: int, wait: (int or float), exp: bool=False, info_level: int=2,
         2: detailed info when last try has failed
         3: only detailed info
 
+    - deadline
+        if given, seconds allowed for all tries and waits in total (TimeoutError when exceeded)
+        for coroutine functions, a running try is cancelled at the deadline
+
+    - policy
+        policies.BackoffPolicy for delays, jitter, retry budget and exception classification
+        if None, it is made of wait (base delay), exp (doubling delays) and the kwargs below
+        if given, its delays override wait and exp, and the kwargs below (when passed) override its fields
+
     - kwargs
         print_func: print (as default) -> logger.warn, etc...
-        wait_func: time.sleep (as default) -> asyncio.wait, etc...
+        wait_func: time.sleep (as default) -> asyncio.sleep (as default for coroutine functions), etc...
+        jitter: 'full' (as default) -> 'equal', 'decorrelated', None (exact delays)
+        max_wait: cap of a single wait
+        exceptions: exceptions to retry (subclasses included), (Exception,) as default, CircuitOpenError is never retried
+
+    - cancellation
+        asyncio.CancelledError is never retried, cancelling the caller cancels the pending try or wait
     
     - example with dummy_return
         @dummy_return(value=None)  # if retry decorator raises exception, this returns dummy value
         @retry(tries=3, wait=2)
         def func(*args, **kwargs):
             ...
+
+    - example with coroutine function
+        @retry(tries=3, wait=2, deadline=10)
+        async def func(*args, **kwargs):
+            ...
     """
     assert info_level in range(4), 'Argument "info_level" should be in range(4)'
 
     print_func = kwargs.get('print_func', print)
-    wait_func = kwargs.get('wait_func', time.sleep)
+    wait_func = kwargs.get('wait_func')
+    if policy is None:
+        policy = BackoffPolicy(
+            base=wait,
+            factor=2 if exp else 1,
+            max_delay=kwargs.get('max_wait'),
+            jitter=kwargs.get('jitter', 'full'),
+            retry_on=kwargs.get('exceptions', (Exception,)),
+            give_up_on=(CircuitOpenError,),
+        )
+    else:
+        overrides = {'exceptions': 'retry_on', 'jitter': 'jitter', 'max_wait': 'max_delay'}
+        changes = {field: kwargs[k] for k, field in overrides.items() if k in kwargs}
+        if changes:
+            policy = policy.replace(**changes)
+
+    def log(func, i):
+        if info_level == 0:
+            return
+        _type, _value, _tb = sys.exc_info()
+        minimal_info = f"{_value} {_type}"
+        if info_level == 1:
+            logging_info = minimal_info
+        elif info_level == 2:
+            logging_info = minimal_info if (i < tries) else traceback.format_exc()
+        else:
+            logging_info = traceback.format_exc()
+        print_func(f"Try {func.__qualname__!r} ({i}/{tries}): {logging_info}")
+
+    def check_retry(e, i, delays, expires, now):
+        """
+        returns seconds to wait before the next try, None when tries are exceeded, raises when giving up
+        """
+        if isinstance(e, CircuitOpenError) or not policy.should_retry(e):  # whatever the policy says
+            raise
+        if i == tries:
+            return None
+        seconds = next(delays)
+        if expires is not None and now + seconds >= expires:
+            raise TimeoutError(f"Deadline exceeded: deadline={deadline!r}") from e
+        if not policy.acquire():
+            raise Exception(f"Retry budget exhausted: {policy.budget!r}") from e
+        return seconds
 
     def decorator(func):
-        
+
+        if asyncio.iscoroutinefunction(func):
+            async_wait_func = wait_func or asyncio.sleep
+
+            @wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                loop = asyncio.get_running_loop()
+                expires = None if deadline is None else loop.time() + deadline
+                delays = policy.delays()
+
+                for i in range(1, tries + 1):
+                    try:
+                        if expires is None:
+                            return await func(*args, **kwargs)
+                        return await asyncio.wait_for(func(*args, **kwargs), max(expires - loop.time(), 0))
+                    except Exception as e:
+                        log(func, i)
+                        seconds = check_retry(e, i, delays, expires, loop.time())
+                        if seconds is None:
+                            break
+
+                    ret = async_wait_func(seconds)
+                    if inspect.isawaitable(ret):
+                        await ret
+
+                raise Exception(f"Tries exceeded: tries={tries!r}")
+
+            return async_wrapper
+
+        # coroutine wait functions (asyncio.sleep) cannot be awaited in a synchronous function
+        sync_wait_func = time.sleep if (wait_func is None or asyncio.iscoroutinefunction(wait_func)) else wait_func
+
         @wraps(func)
         def wrapper(*args, **kwargs):
+            expires = None if deadline is None else time.monotonic() + deadline
+            delays = policy.delays()
+
             for i in range(1, tries + 1):
                 try:
                     return func(*args, **kwargs)
-                except:
-                    wait_func(wait ** i if exp else wait)
-
-                    _type, _value, _tb = sys.exc_info()
-                    minimal_info = f"{_value} {_type}"
-                    detailed_info = traceback.format_exc()
-
-                if info_level == 0:
-                    continue
-                elif info_level == 1:
-                    logging_info = minimal_info
-                elif info_level == 2:
-                    logging_info = minimal_info if (i < tries) else detailed_info
-                elif info_level == 3:
-                    logging_info = detailed_info
-                else:
-                    pass  # pass without any exception, due to working assert statement above
-                print_func(f"Try {func.__qualname__!r} ({i}/{tries}): {logging_info}")
+                except Exception as e:
+                    log(func, i)
+                    seconds = check_retry(e, i, delays, expires, time.monotonic())
+                    if seconds is None:
+                        break
+
+                sync_wait_func(seconds)
 
             raise Exception(f"Tries exceeded: tries={tries!r}")
 
@@ -83,6 +187,430 @@ def retry(tries: int, wait: (int or float), exp: bool=False, info_level: int=2,
     return decorator
 
 
+class CircuitOpenError(Exception):
+    """
+    raised without calling the function while the circuit is open
+    """
+
+
+class CircuitBreaker:
+    """
+    fails fast while a dependency is down, instead of waiting on every call
+
+    - closed: calls pass, outcomes of the last `window` calls are recorded
+      opens when at least `min_calls` are recorded and the failure rate reaches `failure_rate`
+    - open: calls raise CircuitOpenError immediately, for `recovery_time` seconds
+    - half-open: up to `half_open_calls` trial calls pass, success closes and failure opens the circuit again
+
+    only `exceptions` (subclasses included) count as failures, other exceptions pass through as successful calls
+    state is guarded by a lock which is never held across a call or an await, so it is thread- and asyncio-safe
+
+    - example (sync and coroutine functions)
+        breaker = CircuitBreaker(failure_rate=0.5, window=20, min_calls=10, recovery_time=30)
+
+        @dummy_return(value=None)  # returns None while the circuit is open
+        @retry(tries=3, wait=1)    # CircuitOpenError is never retried
+        @breaker
+        def func(*args, **kwargs):
+            ...
+
+    - example with utils.sagemaker.WrappedFunction
+        f.set_wrappers(CircuitBreakerWrapper(breaker), retry_wrapper)
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(
+        self,
+        failure_rate: float=0.5,
+        window: int=20,
+        min_calls: int=10,
+        recovery_time: (int or float)=30,
+        half_open_calls: int=1,
+        exceptions: Tuple[Type[BaseException]]=(Exception,),
+    ):
+        assert 0 < failure_rate <= 1, 'Argument "failure_rate" should be in (0, 1]'
+        assert 0 < min_calls <= window, 'Argument "min_calls" should be in (0, window]'
+        self.failure_rate = failure_rate
+        self.window = window
+        self.min_calls = min_calls
+        self.recovery_time = recovery_time
+        self.half_open_calls = half_open_calls
+        self.exceptions = tuple(exceptions)
+
+        self._lock = threading.Lock()
+        self._outcomes = deque(maxlen=window)  # True for failures
+        self._failures = 0
+        self._state = self.CLOSED
+        self._opened_at = 0.
+        self._trials = 0
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(state={self.state!r}, failures={self._failures}/{len(self._outcomes)})"
+
+    def __call__(self, func: Callable) -> Callable:
+        if asyncio.iscoroutinefunction(func):
+            @wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                return await self.acall(func, *args, **kwargs)
+            async_wrapper.breaker = self
+            return async_wrapper
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            return self.call(func, *args, **kwargs)
+        wrapper.breaker = self
+        return wrapper
+
+    @property
+    def state(self) -> str:
+        if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.recovery_time:
+            return self.HALF_OPEN
+        return self._state
+
+    def call(self, func: Callable, *args, **kwargs):
+        self._before()
+        try:
+            ret = func(*args, **kwargs)
+        except self.exceptions:
+            self._record(failed=True)
+            raise
+        except BaseException:
+            self._record(failed=False)
+            raise
+        self._record(failed=False)
+        return ret
+
+    async def acall(self, func: Callable, *args, **kwargs):
+        self._before()
+        try:
+            ret = await func(*args, **kwargs)
+        except asyncio.CancelledError:
+            self._release_trial()
+            raise
+        except self.exceptions:
+            self._record(failed=True)
+            raise
+        except BaseException:
+            self._record(failed=False)
+            raise
+        self._record(failed=False)
+        return ret
+
+    def reset(self):
+        with self._lock:
+            self._close()
+
+    def _before(self):
+        # fast path without the lock: reading the state is atomic
+        if self._state == self.OPEN and time.monotonic() - self._opened_at < self.recovery_time:
+            raise CircuitOpenError(f"Circuit open: retry after {self.recovery_time - (time.monotonic() - self._opened_at):.1f}s")
+
+        with self._lock:
+            if self._state == self.OPEN:
+                if time.monotonic() - self._opened_at < self.recovery_time:
+                    raise CircuitOpenError("Circuit open")
+                self._state = self.HALF_OPEN
+                self._trials = 0
+            if self._state == self.HALF_OPEN:
+                if self._trials >= self.half_open_calls:
+                    raise CircuitOpenError("Circuit half-open: trial calls in flight")
+                self._trials += 1
+
+    def _record(self, failed: bool):
+        with self._lock:
+            if self._state == self.HALF_OPEN:
+                self._open() if failed else self._close()
+                return
+            if self._state == self.OPEN:
+                return
+
+            if len(self._outcomes) == self.window:
+                self._failures -= self._outcomes[0]
+            self._outcomes.append(failed)
+            self._failures += failed
+
+            if len(self._outcomes) >= self.min_calls and self._failures >= self.failure_rate * len(self._outcomes):
+                self._open()
+
+    def _release_trial(self):
+        with self._lock:
+            if self._state == self.HALF_OPEN and self._trials:
+                self._trials -= 1
+
+    def _open(self):
+        self._state = self.OPEN
+        self._opened_at = time.monotonic()
+
+    def _close(self):
+        self._state = self.CLOSED
+        self._outcomes.clear()
+        self._failures = 0
+        self._trials = 0
+
+
+def circuit_breaker(**kwargs):
+    """
+    decorator making a CircuitBreaker per decorated function, see CircuitBreaker for kwargs
+    the breaker is available as `func.breaker`
+    """
+    def decorator(func):
+        return CircuitBreaker(**kwargs)(func)
+    return decorator
+
+
+CacheInfo = namedtuple('CacheInfo', ['hits', 'misses', 'collapsed', 'evictions', 'maxsize', 'currsize'])
+
+_KWD_MARK = object()
+
+
+def _make_key(*args, **kwargs) -> Hashable:
+    if kwargs:
+        return args + (_KWD_MARK,) + tuple(kwargs.items())
+    if len(args) == 1 and type(args[0]) in (int, str):
+        return args[0]
+    return args
+
+
+class _LRUStore:
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+        return entry
+
+    def put(self, key, entry) -> int:
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        if self.maxsize is not None and len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+            return 1
+        return 0
+
+    def pop(self, key):
+        self.entries.pop(key, None)
+
+    def clear(self):
+        self.entries.clear()
+
+
+class _LFUStore:
+    """
+    O(1) least-frequently-used store: keys are bucketed by use count, ties are evicted in LRU order
+    """
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self.entries = {}
+        self.counts = {}
+        self.buckets = defaultdict(OrderedDict)
+        self.min_count = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is not None:
+            self._touch(key)
+        return entry
+
+    def put(self, key, entry) -> int:
+        if key in self.entries:
+            self.entries[key] = entry
+            self._touch(key)
+            return 0
+
+        evicted = 0
+        if self.maxsize is not None and len(self.entries) >= self.maxsize:
+            if self.min_count not in self.buckets:
+                self.min_count = min(self.buckets)
+            self.pop(next(iter(self.buckets[self.min_count])))
+            evicted = 1
+
+        self.entries[key] = entry
+        self.counts[key] = 1
+        self.buckets[1][key] = None
+        self.min_count = 1
+        return evicted
+
+    def pop(self, key):
+        if key not in self.entries:
+            return
+        del self.entries[key]
+        self._unbucket(key, self.counts.pop(key))
+
+    def clear(self):
+        self.entries.clear()
+        self.counts.clear()
+        self.buckets.clear()
+        self.min_count = 0
+
+    def _touch(self, key):
+        count = self.counts[key]
+        self._unbucket(key, count)
+        if self.min_count == count and count not in self.buckets:
+            self.min_count = count + 1
+        self.counts[key] = count + 1
+        self.buckets[count + 1][key] = None
+
+    def _unbucket(self, key, count: int):
+        bucket = self.buckets[count]
+        del bucket[key]
+        if not bucket:
+            del self.buckets[count]
+
+
+class _Cache:
+    def __init__(self, maxsize: int, ttl: (int or float), policy: str):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.store = _LFUStore(maxsize) if policy == 'lfu' else _LRUStore(maxsize)
+        self.lock = threading.Lock()
+        self.hits = self.misses = self.collapsed = self.evictions = 0
+
+    def get(self, key) -> Tuple[bool, Any]:
+        with self.lock:
+            entry = self.store.get(key)
+            if entry is not None:
+                value, expires = entry
+                if expires is None or expires > time.monotonic():
+                    self.hits += 1
+                    return True, value
+                self.store.pop(key)
+                self.evictions += 1
+            self.misses += 1
+            return False, None
+
+    def put(self, key, value):
+        expires = None if self.ttl is None else time.monotonic() + self.ttl
+        with self.lock:
+            self.evictions += self.store.put(key, (value, expires))
+
+    def info(self) -> CacheInfo:
+        with self.lock:
+            return CacheInfo(self.hits, self.misses, self.collapsed, self.evictions, self.maxsize, len(self.store))
+
+    def clear(self):
+        with self.lock:
+            self.store.clear()
+            self.hits = self.misses = self.collapsed = self.evictions = 0
+
+
+def cached(maxsize: int=128, ttl: (int or float)=None, policy: str='lru', key: Callable=None):
+    """
+    memoizes func's return (coroutine functions as well), exceptions are not cached
+
+    - maxsize: max number of entries (None for unbounded)
+    - ttl: seconds an entry stays valid (None for no expiration)
+    - policy: 'lru' evicts the least recently used entry, 'lfu' the least frequently used one
+    - key: callable with func's arguments returning a hashable key, for unhashable arguments (dict, DataFrame, ...)
+
+    concurrent calls with the same key are collapsed into one computation (single-flight),
+    the other callers wait for its result (or its exception)
+
+    func.cache_info() returns CacheInfo(hits, misses, collapsed, evictions, maxsize, currsize)
+    func.cache_clear() empties the cache
+
+    - example
+        @cached(maxsize=1024, ttl=600, key=lambda df, column: (id(df), column))
+        def expensive(df, column):
+            ...
+    """
+    assert maxsize is None or maxsize > 0, 'Argument "maxsize" should be positive or None'
+    assert policy in ('lru', 'lfu'), f"Invalid policy: {policy!r} (available lru|lfu)"
+    make_key = key or _make_key
+
+    def decorator(func):
+        cache = _Cache(maxsize, ttl, policy)
+        inflight = {}
+        inflight_lock = threading.Lock()
+
+        if asyncio.iscoroutinefunction(func):
+
+            @wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                k = make_key(*args, **kwargs)
+                loop = asyncio.get_running_loop()
+                flight_key = (loop, k)  # futures belong to a loop
+                while True:
+                    found, value = cache.get(k)
+                    if found:
+                        return value
+                    future = inflight.get(flight_key)
+                    if future is None:
+                        break
+                    cache.collapsed += 1
+                    # cancelling this waiter does not cancel the shared future, and vice versa
+                    await asyncio.wait((future,))
+                    if not future.cancelled():
+                        return future.result()
+                    # the leader was cancelled: retry, one of the waiters becomes the new leader
+
+                future = inflight[flight_key] = loop.create_future()
+                future.add_done_callback(lambda f: f.cancelled() or f.exception())  # no "never retrieved" warning
+                try:
+                    value = await func(*args, **kwargs)
+                except asyncio.CancelledError:
+                    future.cancel()
+                    raise
+                except BaseException as e:
+                    future.set_exception(e)
+                    raise
+                else:
+                    cache.put(k, value)
+                    future.set_result(value)
+                    return value
+                finally:
+                    inflight.pop(flight_key, None)
+
+            wrapper = async_wrapper
+
+        else:
+
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                k = make_key(*args, **kwargs)
+                found, value = cache.get(k)
+                if found:
+                    return value
+
+                with inflight_lock:
+                    future = inflight.get(k)
+                    leader = future is None
+                    if leader:
+                        future = inflight[k] = Future()
+                    else:
+                        cache.collapsed += 1
+                if not leader:
+                    return future.result()
+
+                try:
+                    value = func(*args, **kwargs)
+                except BaseException as e:
+                    future.set_exception(e)
+                    raise
+                else:
+                    cache.put(k, value)
+                    future.set_result(value)
+                    return value
+                finally:
+                    with inflight_lock:
+                        inflight.pop(k, None)
+
+        wrapper.cache_info = cache.info
+        wrapper.cache_clear = cache.clear
+        return wrapper
+    return decorator
+
+
 def callback(callback: Callable, out: bool=False):
     """
     callback is a callable object with an only argument of func's return
@@ -125,15 +653,310 @@ def extend_enum(inherited_enum: Enum):
     return wrapper
 
 
-def asynchronous(func):
+_executors = {}
+_executors_lock = threading.Lock()
+
+
+def register_executor(name: str, executor: Executor) -> Executor:
+    """
+    shares an executor under a name, for asynchronous(executor=name)
+    """
+    with _executors_lock:
+        _executors[name] = executor
+    return executor
+
+
+def get_executor(name: str, kind: str='thread', max_workers: int=None) -> Executor:
+    """
+    returns the executor registered under the name, creating a thread or process pool on first use
+    """
+    assert kind in ('thread', 'process'), f"Invalid kind: {kind!r} (available thread|process)"
+    with _executors_lock:
+        if name not in _executors:
+            pool_class = ProcessPoolExecutor if kind == 'process' else ThreadPoolExecutor
+            _executors[name] = pool_class(max_workers=max_workers)
+        return _executors[name]
+
+
+def shutdown_executors(wait: bool=True):
+    with _executors_lock:
+        executors = list(_executors.values())
+        _executors.clear()
+    for executor in executors:
+        executor.shutdown(wait=wait)
+
+
+def asynchronous(func: Callable=None, executor: (str or Executor)=None, kind: str='thread', max_workers: int=None, limit: int=None):
     """
     the decorator to make synchronous function to asynchronous one
+
+    - executor
+        None: the loop's default executor, or a private pool of `kind` when max_workers is given
+        str: shared executor of that name (see register_executor, get_executor), created as `kind` pool on first use
+        Executor: used as it is
+    - kind: 'thread' (as default) or 'process' for CPU-bound functions
+    - max_workers: pool size of a created pool
+    - limit: max concurrent calls per event loop, excess calls wait before being submitted (backpressure)
+
+    contextvars are propagated to thread pools (not to process pools)
+    for process pools, func must be picklable: wrap it instead of decorating it in place
+
+    - example
+        @asynchronous
+        def read(path):
+            ...
+
+        @asynchronous(executor='io', max_workers=32, limit=100)
+        def fetch(url):
+            ...
+
+        transform_async = asynchronous(transform, executor='cpu', kind='process', max_workers=4, limit=8)
+        df = await transform_async(df)
     """
-    
+    assert kind in ('thread', 'process'), f"Invalid kind: {kind!r} (available thread|process)"
+    assert limit is None or limit > 0, 'Argument "limit" should be positive or None'
+
+    if func is None:
+        return partial(asynchronous, executor=executor, kind=kind, max_workers=max_workers, limit=limit)
+
+    pool = None
+    semaphores = weakref.WeakKeyDictionary()
+
+    def get_pool():
+        nonlocal pool
+        if pool is None:
+            if isinstance(executor, str):
+                pool = get_executor(executor, kind, max_workers)
+            elif executor is not None:
+                pool = executor
+            elif max_workers is not None:
+                pool = (ProcessPoolExecutor if kind == 'process' else ThreadPoolExecutor)(max_workers=max_workers)
+        return pool
+
+    async def run(loop, *args, **kwargs):
+        pool = get_pool()
+        if isinstance(pool, ProcessPoolExecutor):
+            f = partial(func, *args, **kwargs)
+        else:
+            f = partial(contextvars.copy_context().run, func, *args, **kwargs)
+        return await loop.run_in_executor(pool, f)
+
     @wraps(func)
     async def wrapper(*args, **kwargs):
-        loop = asyncio.get_event_loop()
-        f = partial(func, *args, **kwargs)
-        return await loop.run_in_executor(None, f)
-    
+        loop = asyncio.get_running_loop()
+        if limit is None:
+            return await run(loop, *args, **kwargs)
+
+        semaphore = semaphores.get(loop)
+        if semaphore is None:
+            semaphore = semaphores[loop] = asyncio.Semaphore(limit)
+        async with semaphore:
+            return await run(loop, *args, **kwargs)
+
     return wrapper
+
+
+if __name__ == "__main__":
+
+    async def loop_latency(seconds: float, interval: float=0.005) -> float:
+        # worst delay of a periodic tick, a blocked event loop shows up here
+        loop = asyncio.get_running_loop()
+        worst = 0.
+        end = loop.time() + seconds
+        while loop.time() < end:
+            ts = loop.time()
+            await asyncio.sleep(interval)
+            worst = max(worst, loop.time() - ts - interval)
+        return worst
+
+    async def benchmark(n_calls: int):
+        attempts = []
+
+        @retry(tries=3, wait=0.2, info_level=0)
+        async def flaky(i):
+            attempts.append(i)
+            raise ConnectionError(i)
+
+        calls = [asyncio.ensure_future(flaky(i)) for i in range(n_calls)]
+        worst = await loop_latency(0.5)
+        results = await asyncio.gather(*calls, return_exceptions=True)
+        assert len(attempts) == 3 * n_calls and all(isinstance(r, Exception) for r in results)
+        return worst
+
+    async def cancel_and_deadline():
+        @retry(tries=100, wait=0.05, info_level=0, deadline=0.2, jitter=None)
+        async def always_fails():
+            raise ValueError
+
+        try:
+            await always_fails()
+        except TimeoutError:
+            pass
+        else:
+            raise AssertionError('deadline should be exceeded')
+
+        @retry(tries=100, wait=10, info_level=0, jitter=None)
+        async def slow_backoff():
+            raise ValueError
+
+        task = asyncio.ensure_future(slow_backoff())
+        await asyncio.sleep(0.05)
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        else:
+            raise AssertionError('task should be cancelled')
+
+    asyncio.run(cancel_and_deadline())
+    for n_calls in (0, 1000):
+        print(f"{n_calls} concurrent calls backing off: worst event-loop lag {asyncio.run(benchmark(n_calls)) * 1e3:.2f} ms")
+
+    # circuit breaker: closed -> open -> half-open -> closed
+    breaker = CircuitBreaker(failure_rate=0.5, window=4, min_calls=4, recovery_time=0.1)
+    outcomes = iter([ConnectionError, ConnectionError, None, ConnectionError, None])
+
+    @dummy_return(value='dummy')
+    @retry(tries=3, wait=0, info_level=0)
+    @breaker
+    def dependency():
+        exc = next(outcomes)
+        if exc:
+            raise exc
+        return 'ok'
+
+    assert [dependency() for _ in range(3)] == ['ok', 'dummy', 'dummy']  # 4th call opens the circuit
+    assert breaker.state == CircuitBreaker.OPEN
+    time.sleep(0.1)
+    assert breaker.state == CircuitBreaker.HALF_OPEN and dependency() == 'ok' and breaker.state == CircuitBreaker.CLOSED
+
+    breaker = CircuitBreaker(window=1, min_calls=1, recovery_time=60)
+    always_down = breaker(lambda: 1 / 0)
+    try:
+        always_down()
+    except ZeroDivisionError:
+        pass
+
+    logged = []
+    try:
+        retry(tries=5, wait=0, policy=BackoffPolicy(base=0), print_func=logged.append)(always_down)()
+    except CircuitOpenError:
+        pass
+    assert len(logged) == 1  # not retried, with a caller's policy as well
+
+    def missing_key():
+        logged.append(1)
+        raise KeyError('x')
+
+    logged = []
+    try:
+        retry(tries=3, wait=0, policy=BackoffPolicy(base=0), exceptions=[ValueError], print_func=lambda *_: None)(missing_key)()
+    except KeyError:
+        pass
+    assert len(logged) == 1  # exceptions narrow a caller's policy
+
+    n_calls = 100000
+    ts = time.perf_counter()
+    for _ in range(n_calls):
+        try:
+            always_down()
+        except CircuitOpenError:
+            pass
+    print(f"open circuit: {(time.perf_counter() - ts) / n_calls * 1e6:.2f} us per call (vs. tries x wait seconds with retry only)")
+
+    # cached: eviction policies, ttl, single-flight
+    @cached(maxsize=2, policy='lfu')
+    def square(x):
+        return x * x
+
+    square(1), square(1), square(2), square(3)  # 2 is the least frequently used
+    assert square.cache_info().evictions == 1 and square(1) == 1 and square.cache_info().hits == 2
+
+    @cached(ttl=0.05, key=lambda d: tuple(sorted(d.items())))
+    def total(d):
+        return sum(d.values())
+
+    total({'a': 1}), total({'a': 1})
+    time.sleep(0.05)
+    total({'a': 1})
+    assert total.cache_info()[:2] == (1, 2)
+
+    computed = []
+
+    @cached()
+    async def fetch(x):
+        computed.append(x)
+        await asyncio.sleep(0.01)
+        return x
+
+    async def fetch_concurrently():
+        return await asyncio.gather(*[fetch(1) for _ in range(100)])
+
+    assert asyncio.run(fetch_concurrently()) == [1] * 100 and computed == [1] and fetch.cache_info().collapsed == 99
+
+    async def cancel_one_caller(cancel_leader):
+        fetch.cache_clear()
+        leader = asyncio.ensure_future(fetch(3))
+        await asyncio.sleep(0)
+        waiter = asyncio.ensure_future(fetch(3))
+        await asyncio.sleep(0)
+        (leader if cancel_leader else waiter).cancel()
+        survivor = waiter if cancel_leader else leader
+        assert await survivor == 3 and not survivor.cancelled()
+        assert (leader if cancel_leader else waiter).cancelled()
+
+    asyncio.run(cancel_one_caller(cancel_leader=True))  # the waiter takes over as the new leader
+    asyncio.run(cancel_one_caller(cancel_leader=False))
+    assert computed == [1, 3, 3, 3]  # cancelled leader, its successor, then the uncancelled leader
+    del computed[1:]
+
+    from functools import lru_cache
+
+    @cached()
+    def load(x):
+        computed.append(x)
+        time.sleep(0.05)
+        return x
+
+    with ThreadPoolExecutor(16) as pool:
+        assert list(pool.map(load, [2] * 16)) == [2] * 16
+    assert computed == [1, 2]
+
+    n_calls = 200000
+    for name, decorator in [
+        ('functools.lru_cache', lru_cache(maxsize=128)),
+        ("cached(policy='lru')", cached(maxsize=128)),
+        ("cached(policy='lfu')", cached(maxsize=128, policy='lfu')),
+        ("cached(ttl=60)", cached(maxsize=128, ttl=60)),
+    ]:
+        hit = decorator(lambda x: x)
+        hit(1)
+        ts = time.perf_counter()
+        for _ in range(n_calls):
+            hit(1)
+        print(f"{name:>22}: {(time.perf_counter() - ts) / n_calls * 1e9:,.0f} ns per hit")
+
+    # asynchronous: bounded executors, concurrency limit, contextvars
+    request_id = contextvars.ContextVar('request_id', default=None)
+    running = []
+
+    def blocking(x):
+        running.append(x)
+        peak = len(running)
+        time.sleep(0.01)
+        running.remove(x)
+        return x, peak, request_id.get()
+
+    async def offload():
+        request_id.set('abc')
+        blocking_async = asynchronous(blocking, executor='io', max_workers=16, limit=4)
+        return await asyncio.gather(*[blocking_async(i) for i in range(40)])
+
+    results = asyncio.run(offload())
+    assert [x for x, _, _ in results] == list(range(40))
+    assert max(peak for _, peak, _ in results) <= 4 and {rid for _, _, rid in results} == {'abc'}
+
+    cpu_bound_async = asynchronous(sum, executor='cpu', kind='process', max_workers=2, limit=2)
+    assert asyncio.run(cpu_bound_async(range(10 ** 6))) == sum(range(10 ** 6))
+    shutdown_executors()
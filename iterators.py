@@ -1,46 +1,351 @@
+import queue
+import threading
+from collections import deque
+from contextlib import nullcontext
+from math import ceil
+
+
 class PopIterator:
-    def __init__(self, popable):
+    def __init__(self, popable, batch_size=1, thread_safe=False):
         """
-        batch_size=1
-        batch_size is not implemented
+        work-queue iterator: pops items from the front in O(1)
+
+        - popable: a deque is consumed in place (use put() to add work), other iterables are copied into a deque
+        - batch_size: if greater than 1, lists of up to batch_size items are returned
+        - thread_safe: if True, several threads can drain the same iterator, rest and total stay accurate
         """
-        self.popable = popable
-        self.rest = self.total = len(popable)
+        assert batch_size > 0, "batch_size should be positive"
+        self.popable = popable if isinstance(popable, deque) else deque(popable)
+        self.batch_size = batch_size
+        self.total = len(self.popable)
+        self._lock = threading.Lock() if thread_safe else nullcontext()
+
+    @property
+    def rest(self):
+        return len(self.popable)
+
+    def __len__(self):
+        return self.rest
 
     def __iter__(self):
         return self
 
     def __next__(self):
-        if len(self.popable) > 0:
-            ret = self.popable.pop(0)
-            self.rest -= 1
-            return ret
-        else:
-            raise StopIteration
+        with self._lock:
+            if not self.popable:
+                raise StopIteration
+            if self.batch_size == 1:
+                return self.popable.popleft()
+            popleft = self.popable.popleft
+            return [popleft() for _ in range(min(self.batch_size, len(self.popable)))]
+
+    def put(self, *items):
+        with self._lock:
+            self.popable.extend(items)
+            self.total += len(items)
 
 
 class PandasIterator:
-    def __init__(self, pandas_obj, batch_size=1, start_index=0):
+    def __init__(self, pandas_obj, batch_size=1, start_index=0, columns=None, as_numpy=False, prefetch=0, shard_id=0, num_shards=1):
+        """
+        iterates a DataFrame / Series in batches of batch_size rows, positions are batch indices
+
+        - start_index: batch index to start from, iteration restarts from it once exhausted
+        - columns: projected once up front, batches are row slices of the projection
+        - as_numpy: batches are row views of one array (a single copy is made up front for mixed dtypes only)
+        - prefetch: number of batches prepared ahead by a background thread
+        - shard_id / num_shards: only batches with index % num_shards == shard_id are returned
+        """
+        assert batch_size > 0, "batch_size should be positive"
+        assert 0 <= shard_id < num_shards, "shard_id should be in [0, num_shards)"
         self.pandas_obj = pandas_obj
         self.batch_size = batch_size
         self.start_index = start_index
         self.current_position = self.start_index
-        assert start_index < len(self), f"start_index should be less than {len(self)}"
+        self.prefetch = prefetch
+        self.shard_id = shard_id
+        self.num_shards = num_shards
+        self.n_batches = ceil(len(pandas_obj) / batch_size)
+        assert 0 <= start_index < max(self.n_batches, 1), f"start_index should be less than {self.n_batches}"
+
+        data = pandas_obj if columns is None else pandas_obj[columns]
+        self._data = data.to_numpy() if as_numpy else data
+        self._slice = self._data.__getitem__ if as_numpy else self._data.iloc.__getitem__
+        self._batches = None
 
     def __len__(self):
-        return ceil(len(self.pandas_obj) / self.batch_size)
+        return len(self._positions())
 
     def __iter__(self):
         return self
 
     def __next__(self):
-        if len(self) > self.current_position:
-            start = self.current_position * self.batch_size
-            end = (self.current_position + 1) * self.batch_size
-            ret = self.pandas_obj.iloc[start:end]
-            self.current_position += 1
-            return ret
-        
-        else:
+        if self._batches is None:
+            self._batches = self._iter_batches()
+            if self.prefetch:
+                self._batches = _prefetch(self._batches, self.prefetch)
+        try:
+            position, batch = next(self._batches)
+        except StopIteration:
+            self._batches = None
             self.current_position = self.start_index
-            raise StopIteration
+            raise
+        self.current_position = position + 1
+        return batch
+
+    def close(self):
+        """
+        stops the prefetch thread of an unfinished iteration and rewinds to start_index
+        """
+        if self._batches is not None:
+            self._batches.close()
+            self._batches = None
+        self.current_position = self.start_index
+
+    def _positions(self):
+        first = self.start_index + (self.shard_id - self.start_index) % self.num_shards
+        return range(first, self.n_batches, self.num_shards)
+
+    def _iter_batches(self):
+        for position in self._positions():
+            start = position * self.batch_size
+            yield position, self._slice(slice(start, start + self.batch_size))
+
+
+class PandasFileIterator:
+    FORMATS = ('parquet', 'csv')
+    CSV_CHUNK_SIZE = 65536
+
+    def __init__(self, path, batch_size=None, columns=None, as_numpy=False, prefetch=0, shard_id=0, num_shards=1, file_format=None, **read_kwargs):
+        """
+        reads a parquet / csv file in fixed memory, one batch at a time
+
+        - parquet: row groups are split across shards, so shards never read the same bytes
+                   batches are whole row groups, or batch_size rows re-cut within the shard's row groups
+        - csv: chunks of batch_size rows (CSV_CHUNK_SIZE as default) are split across shards,
+               every shard still parses the whole file as rows cannot be located without parsing
+        - columns: only these columns are read from disk
+        - as_numpy / prefetch / shard_id / num_shards: same as PandasIterator
+        - file_format: inferred from the suffix if None
+        - read_kwargs: passed to pyarrow.parquet.ParquetFile or pandas.read_csv
+        """
+        file_format = file_format or ('parquet' if str(path).endswith(('.parquet', '.pq')) else 'csv')
+        assert file_format in self.FORMATS, f"Invalid file_format: {file_format!r} (available {'|'.join(self.FORMATS)})"
+        assert 0 <= shard_id < num_shards, "shard_id should be in [0, num_shards)"
+        self.path = path
+        self.batch_size = batch_size
+        self.columns = columns
+        self.as_numpy = as_numpy
+        self.prefetch = prefetch
+        self.shard_id = shard_id
+        self.num_shards = num_shards
+        self.file_format = file_format
+        self.read_kwargs = read_kwargs
+        self.current_position = 0
+        self._batches = None
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._batches is None:
+            self._batches = self._iter_parquet() if self.file_format == 'parquet' else self._iter_csv()
+            if self.prefetch:
+                self._batches = _prefetch(self._batches, self.prefetch)
+        try:
+            position, batch = next(self._batches)
+        except StopIteration:
+            self._batches = None
+            self.current_position = 0
+            raise
+        self.current_position = position + 1
+        return batch.to_numpy() if self.as_numpy else batch
+
+    def close(self):
+        if self._batches is not None:
+            self._batches.close()
+            self._batches = None
+        self.current_position = 0
+
+    def _iter_parquet(self):
+        # following module: pip install pyarrow
+        import pyarrow.parquet as pq
+
+        # pre_buffer (default of pyarrow) would load all selected row groups at once
+        read_kwargs = {'pre_buffer': False, **self.read_kwargs}
+        with pq.ParquetFile(self.path, **read_kwargs) as parquet_file:
+            row_groups = range(self.shard_id, parquet_file.num_row_groups, self.num_shards)
+            if self.batch_size is None:
+                for row_group in row_groups:
+                    yield row_group, parquet_file.read_row_group(row_group, columns=self.columns).to_pandas()
+            elif row_groups:
+                batches = parquet_file.iter_batches(batch_size=self.batch_size, row_groups=row_groups, columns=self.columns)
+                for position, batch in enumerate(batches):
+                    yield position, batch.to_pandas()
+
+    def _iter_csv(self):
+        # following module: pip install pandas
+        import pandas as pd
+
+        chunk_size = self.batch_size or self.CSV_CHUNK_SIZE
+        with pd.read_csv(self.path, chunksize=chunk_size, usecols=self.columns, **self.read_kwargs) as reader:
+            for position, chunk in enumerate(reader):
+                if position % self.num_shards == self.shard_id:
+                    yield position, chunk
+
+
+_DONE = object()
+
+
+def _prefetch(iterable, n):
+    """
+    drives iterable in a daemon thread keeping up to n items ready, errors are re-raised in the consumer
+    closing the generator stops the thread and closes iterable
+    """
+    buffer = queue.Queue(maxsize=n)
+    stop = threading.Event()
+
+    def put(entry):
+        while not stop.is_set():
+            try:
+                buffer.put(entry, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put((True, item)):
+                    return
+            put(_DONE)
+        except BaseException as e:
+            put((False, e))
+        finally:
+            getattr(iterable, 'close', lambda: None)()
+
+    threading.Thread(target=produce, daemon=True).start()
+    try:
+        while True:
+            entry = buffer.get()
+            if entry is _DONE:
+                return
+            ok, value = entry
+            if not ok:
+                raise value
+            yield value
+    finally:
+        stop.set()
+
+
+if __name__ == "__main__":
+    import time
+    from concurrent.futures import ThreadPoolExecutor
+
+    assert list(PopIterator([1, 2, 3, 4, 5], batch_size=2)) == [[1, 2], [3, 4], [5]]
+
+    n_items = 10 ** 5
+    ts = time.perf_counter()
+    work = list(range(n_items))
+    while work:
+        work.pop(0)
+    print(f"list.pop(0): {n_items / (time.perf_counter() - ts):,.0f} items/s")
+
+    ts = time.perf_counter()
+    for _ in PopIterator(range(n_items)):
+        pass
+    print(f"PopIterator: {n_items / (time.perf_counter() - ts):,.0f} items/s")
+
+    iterator = PopIterator(range(n_items), batch_size=100, thread_safe=True)
+    drained = []
+
+    def drain():
+        for batch in iterator:
+            drained.extend(batch)
+
+    with ThreadPoolExecutor(8) as pool:
+        for _ in range(8):
+            pool.submit(drain)
+    assert sorted(drained) == list(range(n_items)) and iterator.rest == 0 and iterator.total == n_items
+
+    import os
+    import tempfile
+    import tracemalloc
+
+    import numpy as np
+    import pandas as pd
+
+    frame = pd.DataFrame(np.arange(10 * 4).reshape(10, 4), columns=list('abcd'))
+    iterator = PandasIterator(frame, batch_size=3, start_index=1)
+    assert len(iterator) == 3 and [len(batch) for batch in iterator] == [3, 3, 1] and iterator.current_position == 1
+    assert [batch.index[0] for batch in iterator] == [3, 6, 9]  # re-iterable from start_index
+    shards = [list(PandasIterator(frame, batch_size=2, shard_id=i, num_shards=2, prefetch=2)) for i in range(2)]
+    assert sorted(index for shard in shards for batch in shard for index in batch.index) == list(range(10))
+    views = list(PandasIterator(frame, batch_size=4, columns=['a', 'b'], as_numpy=True))
+    assert np.shares_memory(views[0], views[1]) or views[0].base is views[1].base
+    assert views[0].tolist() == frame[['a', 'b']].iloc[:4].to_numpy().tolist()
+
+    def failing():
+        yield 0, 0
+        raise ValueError('broken batch')
+
+    prefetched = _prefetch(failing(), 2)
+    assert next(prefetched) == (0, 0)
+    try:
+        next(prefetched)
+    except ValueError:
+        pass
+    else:
+        raise AssertionError('errors of the prefetch thread should reach the consumer')
+
+    n_rows, batch_size = 10 ** 6, 1000
+    frame = pd.DataFrame(np.random.rand(n_rows, 16), columns=[f"c{i}" for i in range(16)])
+
+    ts = time.perf_counter()
+    for start in range(0, n_rows, batch_size):
+        frame.iloc[start:start + batch_size][['c0', 'c1']].to_numpy()
+    print(f"iloc + projection + to_numpy per batch: {n_rows / (time.perf_counter() - ts):,.0f} rows/s")
+
+    ts = time.perf_counter()
+    for batch in PandasIterator(frame, batch_size=batch_size, columns=['c0', 'c1'], as_numpy=True):
+        pass
+    print(f"PandasIterator(as_numpy=True): {n_rows / (time.perf_counter() - ts):,.0f} rows/s")
+
+    def slow_source(n_batches, delay):
+        for position in range(n_batches):
+            time.sleep(delay)  # e.g. decompression or IO
+            yield position
+
+    for prefetch in (0, 4):
+        source = slow_source(50, 0.002)
+        ts = time.perf_counter()
+        for _ in (_prefetch(source, prefetch) if prefetch else source):
+            time.sleep(0.002)  # e.g. a training step
+        print(f"2 ms load + 2 ms step x 50, prefetch={prefetch}: {(time.perf_counter() - ts) * 1e3:.0f} ms")
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        parquet_path = os.path.join(tmpdir, 'frame.parquet')
+        csv_path = os.path.join(tmpdir, 'frame.csv')
+        frame.to_parquet(parquet_path, row_group_size=50000)
+        frame.iloc[:100000].to_csv(csv_path, index=False)
+
+        for path, n_expected in [(parquet_path, n_rows), (csv_path, 100000)]:
+            for batch_size in (None, 30000):
+                n_seen, total = 0, 0.
+                for shard_id in range(3):
+                    for batch in PandasFileIterator(path, batch_size=batch_size, columns=['c0'], shard_id=shard_id, num_shards=3, prefetch=2):
+                        n_seen += len(batch)
+                        total += batch['c0'].sum()
+                assert n_seen == n_expected and abs(total - frame['c0'].iloc[:n_expected].sum()) < 1e-6
+
+        import pyarrow as pa
+
+        tracemalloc.start()
+        arrow_peak = 0
+        for batch in PandasFileIterator(parquet_path, batch_size=10000, as_numpy=True):
+            arrow_peak = max(arrow_peak, pa.total_allocated_bytes())  # arrow buffers are not traced by tracemalloc
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        peak += arrow_peak
+        print(f"parquet file of {frame.memory_usage().sum() / 2 ** 20:.0f} MiB read with a peak of {peak / 2 ** 20:.1f} MiB")
@@ -0,0 +1,196 @@
+import random
+import threading
+import time
+from typing import Dict, Iterator, Tuple, Type
+
+
+class TokenBucket:
+    """
+    tokens refill at `rate` per second up to `capacity`, thread-safe
+
+    - acquire: takes tokens if available, never waits (budgets)
+    - reserve: takes tokens in advance and returns seconds to wait for them (rate limits)
+
+    Example:
+
+        bucket = TokenBucket(rate=100, capacity=1)  # 100 calls per second, no burst
+        time.sleep(bucket.reserve())
+        call()
+    """
+    def __init__(self, rate: float, capacity: float):
+        assert rate >= 0 and capacity > 0, 'Arguments "rate" and "capacity" should be positive'
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(rate={self.rate}, capacity={self.capacity}, tokens={self.tokens:.1f})"
+
+    @property
+    def tokens(self) -> float:
+        with self._lock:
+            self._refill()
+            return self._tokens
+
+    def acquire(self, tokens: float=1) -> bool:
+        """
+        takes tokens without blocking, returns False when the budget is exhausted
+        """
+        with self._lock:
+            self._refill()
+            if self._tokens < tokens:
+                return False
+            self._tokens -= tokens
+            return True
+
+    def reserve(self, tokens: float=1) -> float:
+        """
+        takes tokens even if they are not refilled yet, returns seconds until they are
+        """
+        assert self.rate > 0, 'reserve() needs a positive rate'
+        with self._lock:
+            self._refill()
+            self._tokens -= tokens
+            return 0. if self._tokens >= 0 else -self._tokens / self.rate
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+
+class RetryBudget(TokenBucket):
+    """
+    token bucket shared by retries, every retry takes a token and tokens refill at `rate` per second
+    when a dependency flaps, workers sharing a budget stop retrying instead of piling up (retry storm)
+
+    Example:
+
+        budget = get_budget('sagemaker', rate=1, capacity=10)  # one budget per process and name
+        policy = BackoffPolicy(base=1, jitter='full', budget=budget)
+    """
+
+
+_budgets: Dict[str, RetryBudget] = {}
+_budgets_lock = threading.Lock()
+
+
+def get_budget(name: str='default', rate: float=10., capacity: float=100.) -> RetryBudget:
+    """
+    per-process retry budget registry, rate and capacity only apply when the budget is created
+    """
+    with _budgets_lock:
+        if name not in _budgets:
+            _budgets[name] = RetryBudget(rate, capacity)
+        return _budgets[name]
+
+
+class BackoffPolicy:
+    """
+    delay and classification rules shared by decorators.retry, callbacks.Retriable and utils.sagemaker.RetryWrapper
+
+    - delay of n-th retry (n >= 1): base * factor ** (n - 1), capped by max_delay
+    - jitter
+        None: exact delays
+        'full': uniform(0, delay)
+        'equal': delay / 2 + uniform(0, delay / 2)
+        'decorrelated': uniform(base, previous delay * 3), capped by max_delay
+    - retry_on / give_up_on
+        exception classes, subclasses are matched as well (give_up_on wins)
+    - budget
+        RetryBudget to take a token from before every retry, no retry when exhausted
+
+    Example:
+
+        policy = BackoffPolicy(base=0.5, factor=2, max_delay=30, jitter='full', retry_on=(ConnectionError,))
+        delays = policy.delays()
+        next(delays)  # uniform(0, 0.5)
+        next(delays)  # uniform(0, 1.0)
+    """
+    JITTERS = (None, 'full', 'equal', 'decorrelated')
+
+    def __init__(
+        self,
+        base: float=1.,
+        factor: float=2.,
+        max_delay: float=None,
+        jitter: str=None,
+        retry_on: Tuple[Type[BaseException]]=(Exception,),
+        give_up_on: Tuple[Type[BaseException]]=(),
+        budget: RetryBudget=None,
+    ):
+        assert jitter in self.JITTERS, f"Invalid jitter: {jitter!r} (available {'|'.join(map(str, self.JITTERS))})"
+        self.base = base
+        self.factor = factor
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.retry_on = tuple(retry_on)
+        self.give_up_on = tuple(give_up_on)
+        self.budget = budget
+
+    def __repr__(self):
+        parameters = ", ".join(f"{k}={v!r}" for k, v in self.__dict__.items())
+        return f"{self.__class__.__name__}({parameters})"
+
+    def replace(self, **changes) -> 'BackoffPolicy':
+        """
+        copy with the given arguments changed, the budget (if any) is shared with the copy
+        """
+        return type(self)(**{**self.__dict__, **changes})
+
+    def delays(self) -> Iterator[float]:
+        """
+        endless delays for one call, a new iterator has to be made for every call
+        """
+        attempt = 0
+        previous = self.base
+        while True:
+            attempt += 1
+            if self.jitter == 'decorrelated':
+                delay = random.uniform(self.base, previous * 3)
+            else:
+                delay = self.base * self.factor ** (attempt - 1)
+            if self.max_delay is not None:
+                delay = min(delay, self.max_delay)
+
+            if self.jitter == 'full':
+                delay = random.uniform(0, delay)
+            elif self.jitter == 'equal':
+                delay = delay / 2 + random.uniform(0, delay / 2)
+
+            previous = delay
+            yield delay
+
+    def should_retry(self, exc: BaseException) -> bool:
+        return isinstance(exc, self.retry_on) and not isinstance(exc, self.give_up_on)
+
+    def acquire(self) -> bool:
+        return self.budget is None or self.budget.acquire()
+
+
+if __name__ == "__main__":
+    from itertools import islice
+
+    assert list(islice(BackoffPolicy(base=1, factor=2).delays(), 4)) == [1, 2, 4, 8]
+    assert list(islice(BackoffPolicy(base=1, factor=2, max_delay=3).delays(), 4)) == [1, 2, 3, 3]
+    assert all(0 <= d <= 30 for d in islice(BackoffPolicy(base=1, max_delay=30, jitter='decorrelated').delays(), 100))
+
+    policy = BackoffPolicy(retry_on=(LookupError,), give_up_on=(KeyError,))
+    assert policy.should_retry(IndexError()) and not policy.should_retry(KeyError()) and not policy.should_retry(ValueError())
+    narrowed = policy.replace(retry_on=(IndexError,))
+    assert narrowed.retry_on == (IndexError,) and narrowed.give_up_on == (KeyError,) and policy.retry_on == (LookupError,)
+
+    budget = RetryBudget(rate=0, capacity=3)
+    assert [budget.acquire() for _ in range(4)] == [True, True, True, False]
+
+    bucket = TokenBucket(rate=10, capacity=1)
+    assert bucket.reserve() == 0 and 0.09 < bucket.reserve() <= 0.1 and 0.19 < bucket.reserve() <= 0.2
+
+    # 1000 workers failing at the same moment: when do they retry?
+    for jitter in BackoffPolicy.JITTERS:
+        policy = BackoffPolicy(base=1, factor=2, max_delay=10, jitter=jitter)
+        third_retries = [list(islice(policy.delays(), 3))[-1] for _ in range(1000)]
+        spread = len({round(d, 1) for d in third_retries})
+        print(f"jitter={jitter!s:>12}: 3rd retry delays spread over {spread:>3} distinct 100ms slots")
@@ -0,0 +1,193 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable, Dict, Iterable, List, Tuple
+
+from callbacks import Retriable
+from decorators import asynchronous
+from policies import TokenBucket
+
+
+class BatchResult:
+    """
+    ordered results of a batch, failed items are None in values and their exceptions are kept in errors
+    """
+    def __init__(self, values: List, errors: Dict[int, BaseException]):
+        self.values = values
+        self.errors = errors
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(total={len(self.values)}, failed={len(self.errors)})"
+
+    def __len__(self):
+        return len(self.values)
+
+    def __iter__(self):
+        return iter(self.values)
+
+    def __getitem__(self, index: int):
+        return self.values[index]
+
+    @property
+    def ok(self) -> bool:
+        return not self.errors
+
+    def raise_first(self):
+        if self.errors:
+            raise self.errors[min(self.errors)]
+
+    @classmethod
+    def from_outcomes(cls, outcomes: Iterable[Tuple[bool, Any]]) -> 'BatchResult':
+        values, errors = [], {}
+        for ok, value in outcomes:
+            if ok:
+                values.append(value)
+            else:
+                errors[len(values)] = value
+                values.append(None)
+        return cls(values, errors)
+
+
+class BatchRunner:
+    """
+    calls func(item) for every item concurrently, keeping the input order in the result
+
+    - mode
+        'thread' (as default): run() calls func in a thread pool of max_in_flight threads
+        'async': arun() awaits func (sync functions are run by decorators.asynchronous) with max_in_flight concurrent calls
+    - rate: calls per second (every try counts), burst: calls allowed at once
+    - retry: a decorator such as decorators.retry(tries=3, wait=1), or a callbacks.Retriable
+
+    failures do not stop the batch, they are collected in BatchResult.errors
+
+    Example:
+
+        runner = BatchRunner(requests.get, max_in_flight=32, rate=50, retry=retry(tries=3, wait=1, jitter='full'))
+        result = runner.run(urls)
+        responses = result.values
+        for index, exc in result.errors.items():
+            print(f"{urls[index]} failed: {exc!r}")
+    """
+    def __init__(
+        self,
+        func: Callable,
+        max_in_flight: int=8,
+        rate: float=None,
+        burst: int=1,
+        mode: str='thread',
+        retry: (Callable or Retriable)=None,
+    ):
+        assert mode in ('thread', 'async'), f"Invalid mode: {mode!r} (available thread|async)"
+        assert max_in_flight > 0, 'Argument "max_in_flight" should be positive'
+        self.func = func
+        self.max_in_flight = max_in_flight
+        self.rate = rate
+        self.burst = burst
+        self.mode = mode
+        self.retry = retry
+        self._bucket = None if rate is None else TokenBucket(rate, burst)
+
+    def __repr__(self):
+        parameters = ", ".join(f"{k}={v!r}" for k, v in self.__dict__.items() if not k.startswith("_"))
+        return f"{self.__class__.__name__}({parameters})"
+
+    def run(self, items: Iterable) -> BatchResult:
+        if self.mode == 'async':
+            return asyncio.run(self.arun(items))
+
+        call = self._with_retry(self._rate_limited(self.func))
+        with ThreadPoolExecutor(max_workers=self.max_in_flight) as pool:
+            futures = [pool.submit(self._outcome, call, item) for item in items]
+            return BatchResult.from_outcomes(future.result() for future in futures)
+
+    async def arun(self, items: Iterable) -> BatchResult:
+        func = self.func if asyncio.iscoroutinefunction(self.func) else asynchronous(self.func, max_workers=self.max_in_flight)
+        call = self._with_retry(self._async_rate_limited(func))
+        semaphore = asyncio.Semaphore(self.max_in_flight)
+
+        async def outcome(item):
+            async with semaphore:
+                try:
+                    return True, await call(item)
+                except Exception as e:
+                    return False, e
+
+        return BatchResult.from_outcomes(await asyncio.gather(*map(outcome, items)))
+
+    def _with_retry(self, func: Callable) -> Callable:
+        if self.retry is None:
+            return func
+        if isinstance(self.retry, Retriable):
+            if asyncio.iscoroutinefunction(func):
+                raise TypeError('Retriable cannot retry coroutine functions, use decorators.retry')
+            return partial(self.retry.execute, func)
+        return self.retry(func)
+
+    def _rate_limited(self, func: Callable) -> Callable:
+        if self._bucket is None:
+            return func
+
+        def rate_limited(*args, **kwargs):
+            time.sleep(self._bucket.reserve())
+            return func(*args, **kwargs)
+        return rate_limited
+
+    def _async_rate_limited(self, func: Callable) -> Callable:
+        if self._bucket is None:
+            return func
+
+        async def rate_limited(*args, **kwargs):
+            await asyncio.sleep(self._bucket.reserve())
+            return await func(*args, **kwargs)
+        return rate_limited
+
+    @staticmethod
+    def _outcome(call: Callable, item) -> Tuple[bool, Any]:
+        try:
+            return True, call(item)
+        except Exception as e:
+            return False, e
+
+
+if __name__ == "__main__":
+    from decorators import retry
+    from policies import BackoffPolicy
+
+    latency = 0.05
+    n_items = 100
+
+    def request(i):
+        time.sleep(latency)
+        if i % 10 == 3:
+            raise ConnectionError(i)
+        return i * 2
+
+    async def async_request(i):
+        await asyncio.sleep(latency)
+        if i % 10 == 3:
+            raise ConnectionError(i)
+        return i * 2
+
+    expected = [None if i % 10 == 3 else i * 2 for i in range(n_items)]
+
+    ts = time.perf_counter()
+    sequential = BatchRunner(request, max_in_flight=1).run(range(n_items))
+    print(f"sequential: {n_items / (time.perf_counter() - ts):,.1f} calls/s")
+    assert sequential.values == expected and sorted(sequential.errors) == list(range(3, n_items, 10))
+
+    for name, runner in [
+        ('thread, rate=50', BatchRunner(request, max_in_flight=32, rate=50)),
+        ('async, rate=50', BatchRunner(async_request, max_in_flight=32, rate=50, mode='async')),
+        ('thread, no rate', BatchRunner(request, max_in_flight=32)),
+        ('async, no rate', BatchRunner(async_request, max_in_flight=32, mode='async')),
+    ]:
+        ts = time.perf_counter()
+        result = runner.run(range(n_items))
+        print(f"{name}: {n_items / (time.perf_counter() - ts):,.1f} calls/s ({result!r})")
+        assert result.values == expected
+
+    retried = BatchRunner(request, max_in_flight=8, retry=retry(tries=2, wait=0, info_level=0)).run(range(20))
+    assert isinstance(retried.errors[3], Exception) and retried.values[4] == 8
+    retried = BatchRunner(request, max_in_flight=8, retry=Retriable(2, BackoffPolicy(base=0)).retry_when(ConnectionError)).run(range(20))
+    assert isinstance(retried.errors[13], ConnectionError)
@@ -1,7 +1,11 @@
-from typing import Iterable, List
+from typing import Any, Callable, Iterable, Iterator, List, Sequence
+from itertools import islice
+import collections.abc
 import inspect
+import json
 import psutil
-import sys
+
+from utils.sizing import worker_count
 
 
 def batch_splits(iterable: Iterable, batch_size: int) -> List:
@@ -12,6 +16,103 @@ def batch_splits(iterable: Iterable, batch_size: int) -> List:
     return batches
 
 
+def iter_batches(iterable: Iterable, batch_size: int=None, views: bool=False, max_bytes: int=None, sizeof: Callable[[Any], int]=None) -> Iterator:
+    """
+    streaming batch_splits: batches are made one at a time, so generators work and nothing is materialized up front
+
+    - views
+        if True, batches are zero-copy views of a sliceable source instead of lists
+        numpy arrays, pandas objects (iloc) and ranges give their own slices, bytes-likes give memoryviews,
+        other sequences give SequenceView
+    - max_bytes
+        batches are cut so that the summed sizeof(item) never exceeds max_bytes (batch_size still applies if given)
+        an item larger than max_bytes raises ValueError
+    - sizeof
+        payload size of an item, include separators here (default: _payload_size)
+    """
+    assert batch_size or max_bytes, 'batch_size or max_bytes should be given'
+    if views:
+        assert max_bytes is None, 'views are not supported with max_bytes'
+        slicer = _view_slicer(iterable)
+        for start in range(0, len(iterable), batch_size):
+            yield slicer(start, start + batch_size)
+
+    elif max_bytes is None:
+        pipe = iter(iterable)
+        yield from iter(lambda: list(islice(pipe, batch_size)), [])
+
+    else:
+        sizeof = sizeof or _payload_size
+        batch, batch_bytes = [], 0
+        for item in iterable:
+            item_bytes = sizeof(item)
+            if item_bytes > max_bytes:
+                raise ValueError(f"item of {item_bytes} bytes exceeds max_bytes={max_bytes}")
+            if batch and (batch_bytes + item_bytes > max_bytes or len(batch) == batch_size):
+                yield batch
+                batch, batch_bytes = [], 0
+            batch.append(item)
+            batch_bytes += item_bytes
+        if batch:
+            yield batch
+
+
+class SequenceView(collections.abc.Sequence):
+    """
+    read-only window of sequence[start:stop] without copying, reflects later changes of the sequence
+    """
+    __slots__ = ('sequence', 'start', 'stop')
+
+    def __init__(self, sequence: Sequence, start: int, stop: int):
+        self.sequence = sequence
+        self.start, self.stop, _ = slice(start, stop).indices(len(sequence))
+        self.stop = max(self.start, self.stop)
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({list(self)!r})"
+
+    def __len__(self):
+        return self.stop - self.start
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step != 1:
+                return [self[i] for i in range(start, stop, step)]
+            return SequenceView(self.sequence, self.start + start, self.start + stop)
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('SequenceView index out of range')
+        return self.sequence[self.start + index]
+
+    def __iter__(self):
+        return map(self.sequence.__getitem__, range(self.start, self.stop))
+
+
+def _view_slicer(sliceable) -> Callable[[int, int], Any]:
+    if hasattr(sliceable, 'iloc'):
+        return lambda start, stop: sliceable.iloc[start:stop]
+    if hasattr(sliceable, '__array_interface__') or isinstance(sliceable, (range, memoryview)):
+        return lambda start, stop: sliceable[start:stop]
+    if isinstance(sliceable, (bytes, bytearray)):
+        view = memoryview(sliceable)
+        return lambda start, stop: view[start:stop]
+    if isinstance(sliceable, collections.abc.Sequence):
+        return lambda start, stop: SequenceView(sliceable, start, stop)
+    raise TypeError(f"views need a sliceable source, got {type(sliceable).__name__}")
+
+
+def _payload_size(item) -> int:
+    if isinstance(item, (bytes, bytearray)):
+        return len(item)
+    if isinstance(item, memoryview):
+        return item.nbytes
+    if isinstance(item, str):
+        return len(item.encode('utf-8'))
+    return len(json.dumps(item, ensure_ascii=False).encode('utf-8'))
+
+
 def line_at():
     current_frame = inspect.currentframe()
     outer_frame = current_frame.f_back
@@ -28,8 +129,56 @@ def print_eval(evaluatable: str):
     
     
 def get_multiprocess_count(mem_threshold_percent: int or float, recall: float = 1.0) -> int:
-    mem = psutil.virtual_memory()
-    mem_capacity = max(mem_threshold_percent // (mem.percent * recall) - 1, 1)
-    count = min(sys.cpu_count(), mem_capacity)
+    """
+    workers that fit the usable cpus and mem_threshold_percent of the available memory, cgroup limits included
+    a worker is assumed to take `recall` times the RSS of this process (forked workers start as its copy),
+    use utils.sizing.estimate_worker_memory / worker_count for a measured estimate
+    """
+    worker_memory = psutil.Process().memory_info().rss * recall
+    count = worker_count(worker_memory, memory_fraction=mem_threshold_percent / 100)
     print(f"multiprocess_count: {count}")
     return count
+
+
+if __name__ == "__main__":
+    import time
+    import tracemalloc
+
+    import numpy as np
+    import pandas as pd
+
+    assert list(iter_batches((i for i in range(5)), 2)) == [[0, 1], [2, 3], [4]]
+    assert [list(view) for view in iter_batches(list(range(5)), 2, views=True)] == batch_splits(list(range(5)), 2)
+    assert list(iter_batches(['ab', 'c', 'dé', 'f'], max_bytes=3)) == [['ab', 'c'], ['dé'], ['f']]
+    assert list(iter_batches(['a'] * 5, batch_size=2, max_bytes=100)) == [['a', 'a'], ['a', 'a'], ['a']]
+    assert SequenceView(list(range(10)), 2, 8)[1:-1][::2] == [3, 5]
+    array = np.arange(10)
+    assert all(np.shares_memory(view, array) for view in iter_batches(array, 3, views=True))
+    assert sum(len(view) for view in iter_batches(pd.DataFrame({'a': range(10)}), 3, views=True)) == 10
+    try:
+        list(iter_batches(['x' * 10], max_bytes=5))
+    except ValueError:
+        pass
+    else:
+        raise AssertionError('an item larger than max_bytes should raise')
+
+    n_items, batch_size = 10 ** 6, 1000
+    records = [{'id': i, 'name': f"user{i}"} for i in range(10 ** 5)]
+    for name, make_batches in [
+        ('batch_splits', lambda items: batch_splits(items, batch_size)),
+        ('iter_batches', lambda items: iter_batches(items, batch_size)),
+        ('iter_batches(views=True)', lambda items: iter_batches(items, batch_size, views=True)),
+    ]:
+        items = list(range(n_items))
+        tracemalloc.start()
+        ts = time.perf_counter()
+        for batch in make_batches(items):
+            pass
+        elapsed = time.perf_counter() - ts
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f"{name:>24}: {n_items:,} items, peak {peak / 2 ** 20:6.2f} MiB, {elapsed * 1e3:.0f} ms")
+
+    batches = list(iter_batches(records, max_bytes=256 * 1024))
+    sizes = [sum(map(_payload_size, batch)) for batch in batches]
+    print(f"max_bytes=256KiB: {len(batches)} batches of {min(sizes):,}-{max(sizes):,} bytes")
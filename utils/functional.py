@@ -1,6 +1,12 @@
-from typing import Iterable, Collection, Callable, Tuple, TypeVar
+from typing import AsyncIterable, AsyncIterator, Iterable, Iterator, Collection, Callable, Dict, List, Tuple, TypeVar
 from functools import reduce
-from itertools import chain, groupby, zip_longest, tee
+from itertools import chain, groupby, islice, takewhile, zip_longest, tee
+from collections import Counter, OrderedDict, defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, FIRST_COMPLETED, wait
+import asyncio
+import heapq
+import inspect
+import os
 
 
 Value = TypeVar("Value")
@@ -18,18 +24,39 @@ class functional:
         return self
     
     def flatMap(self, func: Callable) -> Stream:
-        self.pipe = chain(*map(func, self.pipe))
+        self.pipe = chain.from_iterable(map(func, self.pipe))
+        return self
+    
+    def parallelMap(self, func: Callable, workers: int = None, mode: str = 'thread', chunksize: int = 1, ordered: bool = True) -> Stream:
+        """
+        lazy map over a thread or process pool, at most `workers * 2` chunks are in flight (constant memory)
+        
+        - mode: 'thread' for I/O-bound, 'process' for CPU-bound func (func must be picklable)
+        - chunksize: items sent to a worker at once, larger chunks amortize the cost of process pools
+        - ordered: if False, results are yielded as soon as they are done
+        """
+        assert mode in ('thread', 'process'), f"Invalid mode: {mode!r} (available thread|process)"
+        self.pipe = _parallel_map(func, self.pipe, workers or os.cpu_count() or 1, mode, chunksize, ordered)
         return self
     
     def filter(self, func: Callable) -> Stream:
         self.pipe = filter(func, self.pipe)
         return self
     
-    def groupBy(self, key: Callable) -> Stream:
-        pipe = self.pipe
-        pipe = sorted(pipe, key=key)
-        pipe = groupby(pipe, key=key)
-        self.pipe = map(lambda kv: (kv[0], list(kv[1])), pipe)
+    def groupBy(self, key: Callable, sort: bool = True) -> Stream:
+        """
+        if sort is True (as default), sorts items by key and groups them: groups come in order of keys
+        if sort is False, groups by hashing keys in one pass without sorting: groups come in order of first appearance,
+        faster on large inputs but keys must be hashable
+        """
+        if sort:
+            pipe = sorted(self.pipe, key=key)
+            self.pipe = map(lambda kv: (kv[0], list(kv[1])), groupby(pipe, key=key))
+            return self
+        groups = defaultdict(list)
+        for item in self.pipe:
+            groups[key(item)].append(item)
+        self.pipe = iter(groups.items())
         return self
     
     def zip(self, *others: Iterable) -> Stream:
@@ -40,6 +67,107 @@ class functional:
         self.pipe = zip_longest(self.pipe, *map(iter, others), fillvalue=fillvalue)
         return self
     
+    def take(self, n: int) -> Stream:
+        self.pipe = islice(self.pipe, n)
+        return self
+    
+    def skip(self, n: int) -> Stream:
+        self.pipe = islice(self.pipe, n, None)
+        return self
+    
+    def takeWhile(self, func: Callable) -> Stream:
+        self.pipe = takewhile(func, self.pipe)
+        return self
+    
+    def batch(self, n: int) -> Stream:
+        """
+        lists of n items, the last one may be shorter
+        """
+        assert n > 0, 'Argument "n" should be positive'
+        pipe = self.pipe
+        self.pipe = iter(lambda: list(islice(pipe, n)), [])
+        return self
+    
+    def window(self, size: int, step: int = 1) -> Stream:
+        """
+        sliding tuples of `size` items, every `step` items (incomplete windows are dropped)
+        """
+        assert size > 0 and step > 0, 'Arguments "size" and "step" should be positive'
+        self.pipe = _window(self.pipe, size, step)
+        return self
+    
+    def distinct(self, key: Callable = None, maxsize: int = None) -> Stream:
+        """
+        drops items whose key was already seen
+        if maxsize is given, only the `maxsize` most recently seen keys are remembered (bounded memory, approximate)
+        """
+        self.pipe = _distinct(self.pipe, key, maxsize)
+        return self
+    
+    def sortWithin(self, n: int, key: Callable = None) -> Stream:
+        """
+        sorts through a heap of n items: fully sorted if no item is more than n positions away from its place
+        """
+        assert n > 0, 'Argument "n" should be positive'
+        self.pipe = _sort_within(self.pipe, n, key)
+        return self
+    
+    def topK(self, k: int, key: Callable = None, reverse: bool = True) -> List[Value]:
+        """
+        k largest items (k smallest if reverse is False), O(k) memory
+        """
+        return (heapq.nlargest if reverse else heapq.nsmallest)(k, self.pipe, key=key)
+    
+    def countBy(self, key: Callable) -> Dict:
+        return dict(Counter(map(key, self.pipe)))
+    
+    def aggregateBy(self, key: Callable, func: Callable, initial: Value = _initial_missing) -> Dict:
+        """
+        reduces items per key in one pass: {key: func(func(initial, item1), item2), ...}
+        """
+        aggregated = {}
+        for item in self.pipe:
+            k = key(item)
+            if k in aggregated:
+                aggregated[k] = func(aggregated[k], item)
+            else:
+                aggregated[k] = item if initial is self._initial_missing else func(initial, item)
+        return aggregated
+    
+    def sum(self, start: Value = 0) -> Value:
+        return sum(self.pipe, start)
+    
+    def mean(self) -> float:
+        count = total = 0
+        for item in self.pipe:
+            count += 1
+            total += item
+        if not count:
+            raise ValueError("mean of an empty stream")
+        return total / count
+    
+    def minmax(self, key: Callable = None) -> Tuple[Value, Value]:
+        pipe = iter(self.pipe)
+        try:
+            lo = hi = next(pipe)
+        except StopIteration:
+            raise ValueError("minmax of an empty stream")
+        if key is None:
+            for item in pipe:
+                if item < lo:
+                    lo = item
+                elif item > hi:
+                    hi = item
+        else:
+            lo_key = hi_key = key(lo)
+            for item in pipe:
+                k = key(item)
+                if k < lo_key:
+                    lo, lo_key = item, k
+                elif k > hi_key:
+                    hi, hi_key = item, k
+        return lo, hi
+    
     def reduce(self, func: Callable, initial: Value = _initial_missing) -> Value:
         if initial == self._initial_missing:
             return reduce(func, self.pipe)
@@ -55,8 +183,194 @@ class functional:
     def __iter__(self):
         return iter(self.pipe)
     
+
+
+class afunctional:
+    """
+    async counterpart of functional over async (or sync) iterables, results stream while I/O is in flight
+    
+    [Example]
+    (
+        await afunctional(fetch_pages())             # async generator
+        .map(fetch_detail, concurrency=16)           # coroutine function, 16 calls in flight
+        .filter(lambda detail: detail['ok'])
+        .batch(100)
+        .map(insert_bulk)
+        .collect(list)
+    )
+    """
+    def __init__(self, obj: Iterable or AsyncIterable):
+        self.pipe = _aiter(obj)
+    
+    def map(self, func: Callable, concurrency: int = 1, ordered: bool = True) -> Stream:
+        """
+        func may be a coroutine function, up to `concurrency` calls run at once
+        if ordered is False, results are yielded as they complete
+        """
+        assert concurrency > 0, 'Argument "concurrency" should be positive'
+        self.pipe = _amap(func, self.pipe, concurrency, ordered)
+        return self
+    
+    def filter(self, func: Callable) -> Stream:
+        self.pipe = _afilter(func, self.pipe)
+        return self
+    
+    def batch(self, n: int) -> Stream:
+        assert n > 0, 'Argument "n" should be positive'
+        self.pipe = _abatch(self.pipe, n)
+        return self
+    
+    async def collect(self, collection: Collection = list) -> Value:
+        return collection([item async for item in self.pipe])
+    
+    def __aiter__(self):
+        return self.pipe.__aiter__()
+
+
+async def _aiter(obj: Iterable or AsyncIterable) -> AsyncIterator:
+    if hasattr(obj, '__aiter__'):
+        async for item in obj:
+            yield item
+    else:
+        for item in obj:
+            yield item
+
+
+async def _acall(func: Callable, item) -> Value:
+    ret = func(item)
+    return await ret if inspect.isawaitable(ret) else ret
+
+
+async def _amap(func: Callable, source: AsyncIterator, concurrency: int, ordered: bool) -> AsyncIterator:
+    if concurrency == 1:
+        async for item in source:
+            yield await _acall(func, item)
+        return
+    
+    source = source.__aiter__()
+    pending = deque()
+    exhausted = False
+    
+    async def fill():
+        nonlocal exhausted
+        while not exhausted and len(pending) < concurrency:
+            try:
+                item = await source.__anext__()
+            except StopAsyncIteration:
+                exhausted = True
+            else:
+                pending.append(asyncio.ensure_future(_acall(func, item)))
+    
+    try:
+        await fill()
+        while pending:
+            if ordered:
+                if not pending[0].done():
+                    await asyncio.wait([task for task in pending if not task.done()], return_when=asyncio.FIRST_COMPLETED)
+                while pending and pending[0].done():
+                    yield pending.popleft().result()
+            else:
+                done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    pending.remove(task)
+                    yield task.result()
+            await fill()
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+async def _afilter(func: Callable, source: AsyncIterator) -> AsyncIterator:
+    async for item in source:
+        if await _acall(func, item):
+            yield item
+
+
+async def _abatch(source: AsyncIterator, n: int) -> AsyncIterator[List]:
+    batch = []
+    async for item in source:
+        batch.append(item)
+        if len(batch) == n:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _window(iterable: Iterable, size: int, step: int) -> Iterator[Tuple]:
+    pipe = iter(iterable)
+    window = deque(islice(pipe, size), maxlen=size)
+    if len(window) < size:
+        return
+    yield tuple(window)
+    while True:
+        chunk = list(islice(pipe, step))
+        if len(chunk) < step:
+            return
+        window.extend(chunk)
+        yield tuple(window)
+
+
+def _distinct(iterable: Iterable, key: Callable, maxsize: int) -> Iterator:
+    seen = OrderedDict() if maxsize else set()
+    for item in iterable:
+        k = item if key is None else key(item)
+        if k in seen:
+            if maxsize:
+                seen.move_to_end(k)
+            continue
+        if maxsize:
+            seen[k] = None
+            if len(seen) > maxsize:
+                seen.popitem(last=False)
+        else:
+            seen.add(k)
+        yield item
+
+
+def _sort_within(iterable: Iterable, n: int, key: Callable) -> Iterator:
+    heap = []
+    for counter, item in enumerate(iterable):
+        entry = (item if key is None else key(item), counter, item)
+        if len(heap) < n:
+            heapq.heappush(heap, entry)
+        else:
+            yield heapq.heappushpop(heap, entry)[2]
+    while heap:
+        yield heapq.heappop(heap)[2]
+
+
+def _map_chunk(func: Callable, chunk: List) -> List:
+    return list(map(func, chunk))
+
+
+def _parallel_map(func: Callable, iterable: Iterable, workers: int, mode: str, chunksize: int, ordered: bool) -> Iterator:
+    pool_class = ProcessPoolExecutor if mode == 'process' else ThreadPoolExecutor
+    chunks = iter(lambda it=iter(iterable): list(islice(it, chunksize)), [])
+    max_in_flight = workers * 2
+
+    with pool_class(max_workers=workers) as pool:
+        in_flight = deque(pool.submit(_map_chunk, func, chunk) for chunk in islice(chunks, max_in_flight))
+        try:
+            while in_flight:
+                if ordered:
+                    done = [in_flight.popleft()]
+                else:
+                    done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        in_flight.remove(future)
+                for future in done:
+                    for chunk in islice(chunks, 1):
+                        in_flight.append(pool.submit(_map_chunk, func, chunk))
+                    yield from future.result()
+        finally:
+            for future in in_flight:
+                future.cancel()
+    
     
 if __name__ == "__main__":
+    from operator import add
+    
     # _non_iterable = 1
     # functional(_non_iterable) # TypeError: 'int' object is not iterable
     
@@ -74,3 +388,63 @@ if __name__ == "__main__":
     tmp1 = functional(result2).flatMap(lambda x: x) # [4, 2, 2, 5, 3, 3, None, None, 4, None, None, 5]
     result3 = tmp1.zip(result1).collect(dict)
     print(result3) # {4: 2, 2: 4, 5: 5}
+    
+    assert functional([[1, 2], [3]]).flatMap(lambda x: x).collect(list) == [1, 2, 3]
+    assert functional([3, 1, 2, 4]).groupBy(lambda x: x % 2).collect(list) == [(0, [2, 4]), (1, [3, 1])]
+    assert functional([3, 1, 2, 4]).groupBy(lambda x: x % 2, sort=False).collect(list) == [(1, [3, 1]), (0, [2, 4])]
+    assert functional([[1, 'a'], [0, 'b'], [1, 'c']]).groupBy(lambda x: [x[0]]).collect(list) == [([0], [[0, 'b']]), ([1], [[1, 'a'], [1, 'c']])]
+    
+    assert functional(range(7)).batch(3).collect(list) == [[0, 1, 2], [3, 4, 5], [6]]
+    assert functional(range(6)).window(3, 2).collect(list) == [(0, 1, 2), (2, 3, 4)]
+    assert functional(range(10)).skip(2).take(3).collect(list) == [2, 3, 4]
+    assert functional(range(10)).takeWhile(lambda x: x < 3).collect(list) == [0, 1, 2]
+    assert functional([1, 2, 1, 3, 2]).distinct().collect(list) == [1, 2, 3]
+    assert functional([1, 2, 1, 3, 1]).distinct(maxsize=1).collect(list) == [1, 2, 1, 3, 1]
+    assert functional([2, 1, 4, 3, 6, 5]).sortWithin(2).collect(list) == [1, 2, 3, 4, 5, 6]
+    assert functional(range(100)).topK(3) == [99, 98, 97]
+    assert functional('abcab').countBy(str.upper) == {'A': 2, 'B': 2, 'C': 1}
+    assert functional(range(6)).aggregateBy(lambda x: x % 2, add) == {0: 6, 1: 9}
+    assert functional(range(5)).sum() == 10 and functional(range(5)).mean() == 2 and functional([3, 1, 2]).minmax() == (1, 3)
+    
+    async def pages():
+        for page in range(5):
+            await asyncio.sleep(0.01)
+            yield page
+    
+    async def detail(x):
+        await asyncio.sleep(0.05 * (x % 3))
+        return x * 10
+    
+    async def consume():
+        ordered = await afunctional(pages()).map(detail, concurrency=3).filter(lambda x: x > 0).batch(2).collect(list)
+        completed = await afunctional(range(6)).map(detail, concurrency=6, ordered=False).collect(list)
+        return ordered, completed
+    
+    ordered, completed = asyncio.run(consume())
+    assert ordered == [[10, 20], [30, 40]]
+    assert sorted(completed) == [0, 10, 20, 30, 40, 50] and set(completed[:2]) == {0, 30}
+    
+    # memory and throughput against list comprehensions
+    import time
+    import tracemalloc
+    
+    def work(x):
+        return sum(i * i for i in range(x % 50))
+    
+    n_items = 200000
+    benchmarks = [
+        ('list comprehension', lambda: sum([work(x) for x in range(n_items)])),
+        ('map', lambda: functional(range(n_items)).map(work).reduce(add)),
+        ('parallelMap(thread)', lambda: functional(range(n_items)).parallelMap(work, workers=4, chunksize=1000).reduce(add)),
+        ('parallelMap(process)', lambda: functional(range(n_items)).parallelMap(work, workers=4, mode='process', chunksize=1000).reduce(add)),
+        ('parallelMap(process, unordered)', lambda: functional(range(n_items)).parallelMap(work, workers=4, mode='process', chunksize=1000, ordered=False).reduce(add)),
+    ]
+    expected = sum(map(work, range(n_items)))
+    for name, benchmark in benchmarks:
+        tracemalloc.start()
+        ts = time.perf_counter()
+        assert benchmark() == expected
+        elapsed = time.perf_counter() - ts
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f"{name:>32}: {n_items / elapsed:>10,.0f} items/s, peak memory {peak / 2 ** 20:6.2f} MiB")
@@ -0,0 +1,282 @@
+from typing import Any, Awaitable, Callable, Iterable, List
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+import asyncio
+import atexit
+import threading
+
+
+def new_event_loop(use_uvloop: bool=None) -> asyncio.AbstractEventLoop:
+    """
+    new event loop, a uvloop one when use_uvloop is True or None (auto) and uvloop is installed
+    """
+    if use_uvloop is not False:
+        try:
+            # following module: pip install uvloop
+            import uvloop
+        except ImportError:
+            if use_uvloop:
+                raise
+        else:
+            return uvloop.new_event_loop()
+    return asyncio.new_event_loop()
+
+
+class Loop:
+    """
+    - kind
+        'current': the running loop, or a new loop set as the current one (asyncio.get_event_loop is deprecated for this)
+        'new': a new loop set as the current one
+        'running': the running loop, RuntimeError outside of a coroutine
+    - collapse: closes the loop on exit (never the running one)
+
+    Example:
+
+        with Loop('new', collapse=True) as loop:
+            loop.run_until_complete(main())
+    """
+    KINDS = ('current', 'new', 'running')
+
+    def __init__(self, kind: str, collapse: bool=False):
+        assert kind in self.KINDS, f"Invalid kind: {kind!r} (available {'|'.join(self.KINDS)})"
+
+        running = asyncio._get_running_loop()
+        if kind == 'running' or (kind == 'current' and running is not None):
+            self.loop = asyncio.get_running_loop()
+        else:
+            self.loop = new_event_loop()
+            asyncio.set_event_loop(self.loop)
+        self.collapse = collapse and not self.loop.is_running()
+
+    def __enter__(self):
+        return self.loop
+
+    def __exit__(self, type, value, tb):
+        if self.collapse:
+            self.loop.close()
+            asyncio.set_event_loop(None)
+
+
+async def gather_limited(aws: Iterable[Awaitable], limit: int, return_exceptions: bool=False) -> List:
+    """
+    asyncio.gather with at most `limit` awaitables running at once, results keep the order of aws
+
+    only `limit` worker tasks are made, so a generator of thousands of coroutines is consumed lazily
+    on the first error (without return_exceptions) the other workers are cancelled and the error is raised
+    """
+    assert limit > 0, 'limit should be positive'
+    results = []
+    pending = iter(enumerate(aws))
+
+    async def worker():
+        for index, aw in pending:
+            results.append(None)
+            try:
+                value = await aw
+            except Exception as e:
+                if not return_exceptions:
+                    raise
+                value = e
+            results[index] = value
+
+    workers = [asyncio.ensure_future(worker()) for _ in range(limit)]
+    try:
+        await asyncio.gather(*workers)
+    except BaseException:
+        for task in workers:
+            task.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        for _, aw in pending:
+            if asyncio.iscoroutine(aw):
+                aw.close()  # never started, no "was never awaited" warning
+        raise
+    return results
+
+
+class LoopThread:
+    """
+    long-lived event loop in a daemon thread, so that synchronous code can run coroutines without a loop per call
+
+    - submit: schedules a coroutine and returns a concurrent.futures.Future right away
+    - run: submit and wait for the result
+    - map: runs func(item) for every item with at most `limit` at once
+    - shutdown: waits for pending tasks (up to timeout, then cancels them), closes async generators,
+      the default executor and the loop
+
+    Example:
+
+        with LoopThread() as runner:
+            futures = [runner.submit(fetch(url)) for url in urls]
+            pages = runner.map(fetch, urls, limit=500)
+    """
+    def __init__(self, name: str='loop-thread', use_uvloop: bool=None):
+        self.name = name
+        self.loop = new_event_loop(use_uvloop)
+        self._started = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+        self._started.wait()
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(name={self.name!r}, running={self.running}, loop={type(self.loop).__name__})"
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, tb):
+        self.shutdown()
+
+    @property
+    def running(self) -> bool:
+        return self.loop.is_running() and not self.loop.is_closed()
+
+    def submit(self, coro: Awaitable) -> Future:
+        if not self.running:
+            raise RuntimeError(f"{self.name} is not running")
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro: Awaitable, timeout: float=None) -> Any:
+        if threading.current_thread() is self._thread:
+            raise RuntimeError(f"run() would block {self.name} from inside, await the coroutine instead")
+        future = self.submit(coro)
+        try:
+            return future.result(timeout)
+        except FutureTimeoutError:  # not the builtin TimeoutError before python 3.11
+            future.cancel()
+            raise
+
+    def map(self, func: Callable[[Any], Awaitable], items: Iterable, limit: int=100, return_exceptions: bool=False) -> List:
+        return self.run(gather_limited((func(item) for item in items), limit, return_exceptions))
+
+    def call_soon(self, func: Callable, *args):
+        self.loop.call_soon_threadsafe(func, *args)
+
+    def shutdown(self, timeout: float=None):
+        if not self.running:
+            return
+        asyncio.run_coroutine_threadsafe(self._drain(timeout), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+        self.loop.close()
+
+    async def _drain(self, timeout: float=None):
+        current = asyncio.current_task()
+        tasks = [task for task in asyncio.all_tasks() if task is not current]
+        if tasks:
+            _, not_done = await asyncio.wait(tasks, timeout=timeout)
+            for task in not_done:
+                task.cancel()
+            await asyncio.gather(*not_done, return_exceptions=True)
+        await self.loop.shutdown_asyncgens()
+        await self.loop.shutdown_default_executor()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.call_soon(self._started.set)
+        self.loop.run_forever()
+
+
+_loop_thread = None
+_loop_thread_lock = threading.Lock()
+
+
+def get_loop_thread() -> LoopThread:
+    """
+    process-wide LoopThread, started on first use and shut down at exit
+    """
+    global _loop_thread
+    with _loop_thread_lock:
+        if _loop_thread is None or not _loop_thread.running:
+            _loop_thread = LoopThread()
+            atexit.register(_loop_thread.shutdown)
+        return _loop_thread
+
+
+if __name__ == "__main__":
+    import time
+
+    with Loop('new', collapse=True) as loop:
+        assert loop.run_until_complete(asyncio.sleep(0, 'ok')) == 'ok'
+    assert loop.is_closed()
+
+    async def inside():
+        with Loop('current', collapse=True) as loop:
+            assert loop is asyncio.get_running_loop()
+        return loop.is_closed()
+
+    assert asyncio.run(inside()) is False
+
+    async def io_call(x, delay=0.05):
+        await asyncio.sleep(delay)
+        return x * 2
+
+    async def failing(x):
+        raise ValueError(x)
+
+    async def concurrency_of(limit):
+        running, peak = 0, 0
+
+        async def tracked(x):
+            nonlocal running, peak
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0.001)
+            running -= 1
+            return x
+
+        assert await gather_limited((tracked(i) for i in range(100)), limit) == list(range(100))
+        return peak
+
+    assert asyncio.run(concurrency_of(7)) == 7
+    results = asyncio.run(gather_limited([io_call(1, 0), failing(2), io_call(3, 0)], 2, return_exceptions=True))
+    assert results[::2] == [2, 6] and isinstance(results[1], ValueError)
+
+    with LoopThread() as runner:
+        future = runner.submit(io_call(21))
+        assert future.result() == 42 and runner.run(io_call(1)) == 2
+        try:
+            runner.run(gather_limited([failing(1), io_call(1)], 1))
+        except ValueError:
+            pass
+        else:
+            raise AssertionError('errors should reach the caller')
+
+        n_calls = 5000
+        ts = time.perf_counter()
+        assert runner.map(io_call, range(n_calls), limit=1000) == [x * 2 for x in range(n_calls)]
+        print(f"{n_calls:,} x 50 ms calls with limit=1000 from sync code: {time.perf_counter() - ts:.2f} s ({runner!r})")
+
+        ts = time.perf_counter()
+        for x in range(200):
+            asyncio.run(io_call(x, 0))
+        per_call_loop = (time.perf_counter() - ts) / 200
+        ts = time.perf_counter()
+        for x in range(200):
+            runner.run(io_call(x, 0))
+        shared_loop = (time.perf_counter() - ts) / 200
+        print(f"asyncio.run per call: {per_call_loop * 1e6:.0f} us, LoopThread.run: {shared_loop * 1e6:.0f} us")
+
+        cancelled = threading.Event()
+
+        async def hang():
+            try:
+                await asyncio.sleep(60)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        try:
+            runner.run(hang(), timeout=0.05)
+        except FutureTimeoutError:
+            pass
+        else:
+            raise AssertionError('run should time out')
+        assert cancelled.wait(1)  # the coroutine is cancelled as well
+
+        slow = runner.submit(io_call(0, 0.2))
+    assert slow.result() == 0 and not runner.running  # drained before the loop stopped
+
+    runner = LoopThread()
+    stuck = runner.submit(asyncio.sleep(60))
+    runner.shutdown(timeout=0.1)
+    assert stuck.cancelled() and runner.loop.is_closed()
+    assert get_loop_thread() is get_loop_thread()
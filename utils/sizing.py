@@ -0,0 +1,501 @@
+from typing import Callable, Dict, Optional, Tuple
+from collections import deque
+from concurrent.futures import Future
+from math import ceil, floor
+import itertools
+import multiprocessing
+import os
+import sys
+import threading
+import psutil
+
+
+V1_UNLIMITED = 2 ** 62  # v1 reports "no limit" as a page-aligned 2 ** 63 - 1
+
+
+class Cgroup:
+    """
+    cpu and memory limits of the cgroup this process runs in (v1 and v2), limits of parent groups are applied as well
+
+    - root: mount point of the cgroup filesystem
+    - proc_cgroup: membership file of the process (lines of "hierarchy:controllers:path")
+
+    a group path that is not visible under root (cgroup namespaces, as in most containers) falls back to root
+
+    Example:
+
+        cgroup = Cgroup()
+        cgroup.cpu_quota     # 1.5 for cpu.max = "150000 100000", None when unlimited
+        cgroup.memory_limit  # bytes, None when unlimited
+    """
+    def __init__(self, root: str='/sys/fs/cgroup', proc_cgroup: str='/proc/self/cgroup'):
+        self.root = root
+        self.version = 2 if os.path.exists(os.path.join(root, 'cgroup.controllers')) else 1
+        self.paths = self._read_paths(proc_cgroup)
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(root={self.root!r}, version={self.version}, cpu_quota={self.cpu_quota}, memory_limit={self.memory_limit})"
+
+    @property
+    def cpu_quota(self) -> Optional[float]:
+        quotas = []
+        for directory in self._directories('cpu', ('cpu', 'cpu,cpuacct', 'cpuacct,cpu')):
+            if self.version == 2:
+                values = _read(directory, 'cpu.max')
+                quota, period = values.split() if values else ('max', None)
+            else:
+                quota, period = _read(directory, 'cpu.cfs_quota_us'), _read(directory, 'cpu.cfs_period_us')
+            if quota not in (None, 'max', '-1') and period:
+                quotas.append(int(quota) / int(period))
+        return min(quotas, default=None)
+
+    @property
+    def memory_limit(self) -> Optional[int]:
+        limits = []
+        for directory in self._directories('memory', ('memory',)):
+            limit = _read(directory, 'memory.max' if self.version == 2 else 'memory.limit_in_bytes')
+            if limit not in (None, 'max') and int(limit) < V1_UNLIMITED:
+                limits.append(int(limit))
+        return min(limits, default=None)
+
+    @property
+    def memory_usage(self) -> Optional[int]:
+        for directory in self._directories('memory', ('memory',)):
+            usage = _read(directory, 'memory.current' if self.version == 2 else 'memory.usage_in_bytes')
+            return None if usage is None else int(usage)
+
+    def _read_paths(self, proc_cgroup: str) -> Dict[str, str]:
+        paths = {}
+        try:
+            with open(proc_cgroup) as f:
+                for line in f:
+                    _, controllers, path = line.rstrip('\n').split(':', 2)
+                    for controller in controllers.split(',') if controllers else ['']:
+                        paths[controller] = path
+        except OSError:
+            pass
+        return paths
+
+    def _directories(self, controller: str, mounts: Tuple[str]):
+        """
+        the group directory of the controller and its parents up to the mount point
+        """
+        if self.version == 2:
+            bases, path = [self.root], self.paths.get('', '/')
+        else:
+            bases, path = [os.path.join(self.root, mount) for mount in mounts], self.paths.get(controller, '/')
+
+        for base in bases:
+            if not os.path.isdir(base):
+                continue
+            directory = os.path.join(base, path.lstrip('/'))
+            if not os.path.isdir(directory):
+                directory = base
+            while True:
+                yield directory
+                if os.path.samefile(directory, base):
+                    break
+                directory = os.path.dirname(directory)
+            return
+
+
+def _read(directory: str, name: str) -> Optional[str]:
+    try:
+        with open(os.path.join(directory, name)) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def available_cpus(cgroup: Cgroup=None) -> int:
+    """
+    cpus this process may use: affinity mask, capped by the cgroup cpu quota (rounded up)
+    """
+    cgroup = cgroup or Cgroup()
+    cpus = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count() or 1
+    quota = cgroup.cpu_quota
+    return max(1, min(cpus, ceil(quota))) if quota else cpus
+
+
+def available_memory(cgroup: Cgroup=None) -> int:
+    """
+    bytes that can still be allocated: the smaller of host available memory and the cgroup headroom
+    """
+    cgroup = cgroup or Cgroup()
+    available = psutil.virtual_memory().available
+    limit, usage = cgroup.memory_limit, cgroup.memory_usage
+    if limit is not None and usage is not None:
+        available = min(available, max(limit - usage, 0))
+    return available
+
+
+def _peak_rss(func: Callable, args: tuple, kwargs: dict) -> int:
+    import resource
+
+    func(*args, **kwargs)
+    # ru_maxrss is in kilobytes on linux and in bytes on macOS
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+
+
+def estimate_worker_memory(func: Callable, *args, **kwargs) -> int:
+    """
+    peak RSS in bytes of a fresh worker process running one sample task, interpreter and imports included
+    """
+    with multiprocessing.get_context('spawn').Pool(1) as pool:
+        return pool.apply(_peak_rss, (func, args, kwargs))
+
+
+def worker_count(worker_memory: int=None, memory_fraction: float=0.8, max_workers: int=None, cgroup: Cgroup=None) -> int:
+    """
+    number of workers that fit both the cpus and memory_fraction of the available memory (at least 1)
+
+    - worker_memory: bytes per worker (see estimate_worker_memory), cpus only if None
+    """
+    cgroup = cgroup or Cgroup()
+    count = available_cpus(cgroup)
+    if worker_memory:
+        count = min(count, floor(available_memory(cgroup) * memory_fraction / worker_memory))
+    if max_workers:
+        count = min(count, max_workers)
+    return max(count, 1)
+
+
+def _worker(tasks, results):
+    pid = os.getpid()
+    for task_id, func, args, kwargs in iter(tasks.get, None):
+        try:
+            outcome = (True, func(*args, **kwargs))
+        except BaseException as e:
+            outcome = (False, e)
+        try:
+            results.put(('done', task_id, outcome))
+        except Exception as e:  # unpicklable result
+            results.put(('done', task_id, (False, e)))
+    results.put(('retired', None, pid))
+
+
+class AdaptiveProcessPool:
+    """
+    process pool that adds or drops workers every `interval` seconds from live memory and load
+    submit() returns concurrent.futures.Future, tasks of a worker that dies (e.g. OOM-killed) fail with ChildProcessError
+
+    - grows by one while there is a backlog, the memory after one more average worker stays under memory_high
+      and the 1-minute load average per cpu stays under max_load
+    - shrinks by one when the memory goes over memory_high or the load over max_load
+    - memory is the cgroup usage / limit if there is a limit, the host memory otherwise
+    - max_workers: worker_count() (cpus) if None
+
+    Example:
+
+        with AdaptiveProcessPool(min_workers=2, memory_high=0.8) as pool:
+            results = list(pool.map(transform, chunks))
+    """
+    def __init__(
+        self,
+        min_workers: int=1,
+        max_workers: int=None,
+        memory_high: float=0.85,
+        max_load: float=1.5,
+        interval: float=1.,
+        cgroup: Cgroup=None,
+        mp_context: str=None,
+    ):
+        self.cgroup = cgroup or Cgroup()
+        self.min_workers = min_workers
+        self.max_workers = max(max_workers or worker_count(cgroup=self.cgroup), min_workers)
+        self.memory_high = memory_high
+        self.max_load = max_load
+        self.interval = interval
+        self.context = multiprocessing.get_context(mp_context)
+
+        # SimpleQueue writes synchronously, a worker killed right after put() does not lose the message
+        self._results = self.context.SimpleQueue()
+        self._lock = threading.Lock()
+        self._pending = deque()
+        self._futures: Dict[int, Future] = {}
+        # one task queue per worker: a task is assigned to a pid when dispatched, so a dead worker's tasks
+        # are known even if it died before running them
+        self._queues: Dict[int, multiprocessing.SimpleQueue] = {}
+        self._assigned: Dict[int, int] = {}  # task_id: pid
+        self._idle = deque()
+        self._retiring = set()
+        self._to_retire = 0  # busy workers to retire once their task is done
+        self._processes: Dict[int, multiprocessing.Process] = {}
+        self._target = 0
+        self._ids = itertools.count()
+        self._shutdown = threading.Event()
+
+        with self._lock:
+            for _ in range(min_workers):
+                self._add_worker()
+        self._threads = [
+            threading.Thread(target=self._collect, daemon=True),
+            threading.Thread(target=self._monitor, daemon=True),
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(workers={self.workers}, min_workers={self.min_workers}, max_workers={self.max_workers})"
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+
+    @property
+    def workers(self) -> int:
+        return self._target
+
+    def submit(self, func: Callable, *args, **kwargs) -> Future:
+        assert not self._shutdown.is_set(), 'cannot submit after shutdown'
+        future = Future()
+        with self._lock:
+            task_id = next(self._ids)
+            self._futures[task_id] = future
+            self._pending.append((task_id, func, args, kwargs))
+            self._dispatch()
+        return future
+
+    def map(self, func: Callable, *iterables):
+        futures = [self.submit(func, *args) for args in zip(*iterables)]
+        return (future.result() for future in futures)
+
+    def shutdown(self, wait: bool=True):
+        if wait:
+            with self._lock:
+                futures = list(self._futures.values())
+            for future in futures:
+                future.exception()
+        self._shutdown.set()
+        with self._lock:
+            for task_id, *_ in self._pending:
+                self._futures.pop(task_id).cancel()
+            self._pending.clear()
+            for pid in self._processes:
+                if pid not in self._retiring:
+                    self._retire(pid)
+            self._target = 0
+        for process in list(self._processes.values()):
+            process.join()
+        self._results.put(('stop', None, None))
+        for thread in self._threads:
+            thread.join()
+
+    def decide(self, memory: float, worker_memory: float, load: float) -> int:
+        """
+        +1, -1 or 0 workers for memory (used fraction), worker_memory (average worker fraction) and load per cpu
+        """
+        if (memory > self.memory_high or load > self.max_load) and self._target > self.min_workers:
+            return -1
+        if (
+            self._pending and self._target < self.max_workers
+            and memory + worker_memory <= self.memory_high and load <= self.max_load
+        ):
+            return 1
+        return 0
+
+    def _dispatch(self):
+        while self._pending and self._idle:
+            pid = self._idle.popleft()
+            if not self._processes[pid].is_alive():
+                continue  # left to _reap
+            task = self._pending.popleft()
+            self._assigned[task[0]] = pid
+            self._queues[pid].put(task)
+
+    def _add_worker(self):
+        tasks = self.context.SimpleQueue()
+        process = self.context.Process(target=_worker, args=(tasks, self._results), daemon=True)
+        process.start()
+        self._processes[process.pid] = process
+        self._queues[process.pid] = tasks
+        self._idle.append(process.pid)
+        self._target += 1
+        self._dispatch()
+
+    def _remove_worker(self):
+        self._target -= 1
+        if self._idle:
+            self._retire(self._idle.popleft())
+        else:
+            self._to_retire += 1
+
+    def _retire(self, pid: int):
+        self._retiring.add(pid)
+        self._queues[pid].put(None)
+
+    def _release(self, pid: int):
+        if self._to_retire:
+            self._to_retire -= 1
+            self._retire(pid)
+        elif pid not in self._retiring:
+            self._idle.append(pid)
+
+    def _forget(self, pid: int):
+        self._processes.pop(pid).join()
+        self._queues.pop(pid)
+        self._retiring.discard(pid)
+        if pid in self._idle:
+            self._idle.remove(pid)
+
+    def _collect(self):
+        while True:
+            kind, task_id, value = self._results.get()
+            if kind == 'stop':
+                return
+            with self._lock:
+                if kind == 'done':
+                    pid = self._assigned.pop(task_id, None)
+                    if pid is None:  # the worker died after sending it, _reap has failed the task already
+                        continue
+                    ok, result = value
+                    future = self._futures.pop(task_id)
+                    future.set_result(result) if ok else future.set_exception(result)
+                    self._release(pid)
+                    self._dispatch()
+                elif kind == 'retired' and value in self._processes:
+                    self._forget(value)
+
+    def _monitor(self):
+        cpus = available_cpus(self.cgroup)
+        while not self._shutdown.wait(self.interval):
+            memory, worker_memory = self._memory()
+            load = os.getloadavg()[0] / cpus if hasattr(os, 'getloadavg') else 0.
+            with self._lock:
+                if self._shutdown.is_set():
+                    return
+                self._reap()
+                delta = self.decide(memory, worker_memory, load)
+                if delta > 0:
+                    self._add_worker()
+                elif delta < 0:
+                    self._remove_worker()
+
+    def _memory(self) -> Tuple[float, float]:
+        limit, usage = self.cgroup.memory_limit, self.cgroup.memory_usage
+        if limit is None or usage is None:
+            memory = psutil.virtual_memory()
+            limit, usage = memory.total, memory.total - memory.available
+
+        rss = []
+        for pid in list(self._processes):
+            try:
+                rss.append(psutil.Process(pid).memory_info().rss)
+            except psutil.Error:
+                pass
+        return usage / limit, (sum(rss) / len(rss) if rss else 0) / limit
+
+    def _reap(self):
+        for pid, process in list(self._processes.items()):
+            if process.is_alive():
+                continue
+            if pid not in self._retiring:  # retired workers are already uncounted
+                if self._to_retire:  # it was due to retire anyway
+                    self._to_retire -= 1
+                else:
+                    self._target -= 1
+            self._forget(pid)
+            lost = [task_id for task_id, worker in self._assigned.items() if worker == pid]
+            for task_id in lost:
+                del self._assigned[task_id]
+            if self._target < self.min_workers and not self._shutdown.is_set():
+                self._add_worker()
+            for task_id in lost:
+                self._futures.pop(task_id).set_exception(
+                    ChildProcessError(f"worker {pid} died with exit code {process.exitcode}")
+                )
+
+
+if __name__ == "__main__":
+    import tempfile
+    import time
+
+    class ExitOnLoad:
+        def __reduce__(self):
+            return os._exit, (1,)
+
+    def exit_after_return(delay):
+        time.sleep(delay)
+        threading.Timer(0.01, os._exit, (1,)).start()
+        return delay
+
+    def make_files(root, files):
+        for path, content in files.items():
+            os.makedirs(os.path.dirname(os.path.join(root, path)), exist_ok=True)
+            with open(os.path.join(root, path), 'w') as f:
+                f.write(content)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        # v2: limits of the parent group apply to its children
+        make_files(tmpdir, {
+            'v2/cgroup.controllers': 'cpu memory',
+            'v2/cpu.max': 'max 100000',
+            'v2/memory.max': str(2 * 2 ** 30),
+            'v2/job/cpu.max': '150000 100000',
+            'v2/job/memory.max': 'max',
+            'v2/job/memory.current': str(2 ** 30),
+            'v2.cgroup': '0::/job\n',
+        })
+        cgroup = Cgroup(os.path.join(tmpdir, 'v2'), os.path.join(tmpdir, 'v2.cgroup'))
+        assert cgroup.version == 2 and cgroup.cpu_quota == 1.5
+        assert cgroup.memory_limit == 2 * 2 ** 30 and cgroup.memory_usage == 2 ** 30
+        assert available_cpus(cgroup) == min(2, len(os.sched_getaffinity(0)))
+        assert available_memory(cgroup) <= 2 ** 30
+        assert worker_count(worker_memory=2 ** 28, memory_fraction=1, cgroup=cgroup) <= 4
+
+        # v1: separate hierarchies per controller, unlimited values, namespaced paths that are not visible
+        make_files(tmpdir, {
+            'v1/cpu,cpuacct/cpu.cfs_quota_us': '-1',
+            'v1/cpu,cpuacct/cpu.cfs_period_us': '100000',
+            'v1/cpu,cpuacct/docker/abc/cpu.cfs_quota_us': '50000',
+            'v1/cpu,cpuacct/docker/abc/cpu.cfs_period_us': '100000',
+            'v1/memory/memory.limit_in_bytes': '9223372036854771712',
+            'v1/memory/memory.usage_in_bytes': str(2 ** 20),
+            'v1.cgroup': '4:memory:/not/visible\n3:cpu,cpuacct:/docker/abc\n',
+        })
+        cgroup = Cgroup(os.path.join(tmpdir, 'v1'), os.path.join(tmpdir, 'v1.cgroup'))
+        assert cgroup.version == 1 and cgroup.cpu_quota == 0.5 and available_cpus(cgroup) == 1
+        assert cgroup.memory_limit is None and cgroup.memory_usage == 2 ** 20
+
+        # the pool grows under a backlog and drops workers once the (fake) cgroup memory passes memory_high
+        limit = 8 * 2 ** 30
+        make_files(tmpdir, {
+            'pool/cgroup.controllers': '',
+            'pool/memory.max': str(limit),
+            'pool/memory.current': str(limit // 10),
+            'pool.cgroup': '0::/\n',
+        })
+        cgroup = Cgroup(os.path.join(tmpdir, 'pool'), os.path.join(tmpdir, 'pool.cgroup'))
+        with AdaptiveProcessPool(min_workers=1, max_workers=4, memory_high=0.8, max_load=float('inf'), interval=0.05, cgroup=cgroup) as pool:
+            futures = [pool.submit(time.sleep, 0.05) for _ in range(100)]
+            while pool.workers < 4:
+                time.sleep(0.01)
+            grown = pool.workers
+            make_files(tmpdir, {'pool/memory.current': str(limit * 9 // 10)})
+            while pool.workers > 1:
+                time.sleep(0.01)
+            assert all(future.exception() is None for future in futures)
+            assert list(pool.map(pow, [2, 3], [3, 2])) == [8, 9]
+            assert isinstance(pool.submit(int, 'x').exception(), ValueError)
+            print(f"fake cgroup: grew to {grown} workers under a backlog, shrank to {pool.workers} over memory_high")
+
+            killed = pool.submit(os._exit, 1)
+            assert isinstance(killed.exception(timeout=5), ChildProcessError) and pool.workers >= 1
+
+            # dies while unpickling the task, before running it
+            lost = pool.submit(print, ExitOnLoad())
+            assert isinstance(lost.exception(timeout=5), ChildProcessError)
+
+            # dies right after sending 'done', and the reaper gets to it before the collector
+            late = pool.submit(exit_after_return, 0.1)
+            with pool._lock:
+                pool._processes[pool._assigned[max(pool._assigned)]].join()
+                pool._reap()
+            assert isinstance(late.exception(timeout=5), ChildProcessError)
+            assert pool.submit(pow, 2, 5).result(timeout=5) == 32
+
+    print(Cgroup())
+    print(f"this machine: {available_cpus()} cpus, {available_memory() / 2 ** 30:.1f} GiB available, "
+          f"{estimate_worker_memory(sum, range(10 ** 6)) / 2 ** 20:.0f} MiB per worker, {worker_count()} workers")
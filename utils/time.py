@@ -1,6 +1,18 @@
-from datetime import datetime
+from typing import IO, Callable, Dict, Iterable, Iterator, Optional, Tuple, Union
+from collections import defaultdict, deque
+from datetime import datetime, timedelta
 from functools import wraps
 from contextlib import contextmanager
+from random import random
+import asyncio
+import contextvars
+import inspect
+import itertools
+import json
+import multiprocessing
+import os
+import threading
+import time
 
 
 class ETA:
@@ -16,7 +28,7 @@ class ETA:
             return cur_time + (rest_length * per_time)
         
         else:
-            return float('inf')
+            return None  # see Progress for a smoothed estimate
 
 
 class TimeElapsed:
@@ -25,11 +37,12 @@ class TimeElapsed:
         def wrapper(*args, **kwargs):
             ts = datetime.now()
             print(f"[{ts}] {func.__qualname__!r} begins")
+            start = time.perf_counter()
 
             ret = func(*args, **kwargs)
 
-            te = datetime.now()
-            print(f"[{te}] {func.__qualname__!r} ends (elapsed: {te - ts})")
+            elapsed = timedelta(seconds=time.perf_counter() - start)
+            print(f"[{datetime.now()}] {func.__qualname__!r} ends (elapsed: {elapsed})")
 
             return ret
         return wrapper
@@ -38,8 +51,682 @@ class TimeElapsed:
     def contextmanager(name: str = "unknown"):
         ts = datetime.now()
         print(f"[{ts}] {name!r} begins")
+        start = time.perf_counter()
 
         yield
 
-        te = datetime.now()
-        print(f"[{te}] {name!r} ends (elapsed: {te - ts})")
+        elapsed = timedelta(seconds=time.perf_counter() - start)
+        print(f"[{datetime.now()}] {name!r} ends (elapsed: {elapsed})")
+
+
+class Histogram:
+    """
+    log-linear histogram of nanoseconds in fixed memory, percentiles are within 1 / SUB_BUCKETS (6%) of the truth
+
+    bucket of n: n itself below SUB_BUCKETS, otherwise the top 5 bits of n and its magnitude
+    """
+    SUB_BUCKETS = 16
+
+    def __init__(self):
+        self.count = 0
+        self.weight = 0.  # estimated calls, sampled spans weigh 1 / sample_rate
+        self.total = 0.  # estimated total ns
+        self.min = None
+        self.max = 0
+        self.buckets = defaultdict(int)
+
+    def add(self, ns: int, weight: float=1.):
+        self.count += 1
+        self.weight += weight
+        self.total += ns * weight
+        self.min = ns if self.min is None else min(self.min, ns)
+        self.max = max(self.max, ns)
+        if ns < self.SUB_BUCKETS:
+            self.buckets[ns] += 1
+        else:
+            shift = ns.bit_length() - 5
+            self.buckets[shift * self.SUB_BUCKETS + (ns >> shift)] += 1
+
+    def merge(self, other: 'Histogram'):
+        self.count += other.count
+        self.weight += other.weight
+        self.total += other.total
+        if other.min is not None:
+            self.min = other.min if self.min is None else min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        for bucket, count in other.buckets.items():
+            self.buckets[bucket] += count
+
+    def percentile(self, q: float) -> float:
+        if not self.count:
+            return 0.
+        rank, seen = q / 100 * self.count, 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= rank:
+                break
+        if bucket < self.SUB_BUCKETS:
+            return float(bucket)
+        shift, mantissa = divmod(bucket, self.SUB_BUCKETS)
+        shift, mantissa = shift - 1, mantissa + self.SUB_BUCKETS
+        middle = ((mantissa << shift) + ((mantissa + 1) << shift) - 1) / 2
+        return min(max(middle, self.min), self.max)
+
+    def summary(self) -> Dict[str, float]:
+        return {
+            'count': self.count,
+            'calls': round(self.weight),
+            'total_ns': self.total,
+            'mean_ns': self.total / self.weight if self.weight else 0.,
+            'p50_ns': self.percentile(50),
+            'p95_ns': self.percentile(95),
+            'p99_ns': self.percentile(99),
+            'max_ns': self.max,
+        }
+
+
+SpanRecord = Dict[str, Union[str, int, None]]
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    __slots__ = ('profiler', 'name', 'weight', 'id', 'parent', 'start', 'token')
+
+    def __init__(self, profiler: 'Profiler', name: str, weight: float):
+        self.profiler = profiler
+        self.name = name
+        self.weight = weight
+
+    def __enter__(self):
+        profiler = self.profiler
+        self.parent = profiler._current.get()
+        self.id = next(profiler._ids)
+        self.token = profiler._current.set(self.id)
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc_info):
+        end = time.perf_counter_ns()
+        self.profiler._current.reset(self.token)
+        self.profiler._record(self, end)
+        return False
+
+
+class Profiler:
+    """
+    hierarchical timing on time.perf_counter_ns
+
+    - spans nest through a ContextVar, so parents are right across threads and asyncio tasks
+    - every name gets a Histogram (count, p50/p95/p99, total), the last max_spans spans are kept for exporters
+    - sample_rate: fraction of spans measured (per profiler, or per span / function), sampled totals are scaled up
+    - disabled or sampled out spans cost one shared no-op context manager: ~30 ns for span() and ~125 ns for the
+      with statement itself (python 3.11), guard sub-microsecond loops with `if profiler.enabled` instead
+    - functions decorated with profile() while the profiler is disabled are returned unwrapped (no cost at all),
+      enable() afterwards does not profile them; functions decorated while enabled cost ~80 ns per call once disabled
+
+    Example:
+
+        profiler = Profiler()
+
+        @profiler.profile(sample_rate=0.01)
+        def hot(x): ...
+
+        with profiler.span('epoch'):
+            for x in xs:
+                hot(x)
+
+        print(profiler.format_report())
+        profiler.export_chrome_trace('trace.json')  # chrome://tracing or ui.perfetto.dev
+    """
+    def __init__(self, enabled: bool=True, sample_rate: float=1., max_spans: int=100000):
+        assert 0 < sample_rate <= 1, 'sample_rate should be in (0, 1]'
+        self.enabled = enabled
+        self.sample_rate = sample_rate
+        self.histograms: Dict[str, Histogram] = defaultdict(Histogram)
+        self.spans = deque(maxlen=max_spans)
+        self.origin = time.perf_counter_ns()
+        self._current = contextvars.ContextVar(f"span_{id(self)}", default=None)
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(enabled={self.enabled}, sample_rate={self.sample_rate}, names={len(self.histograms)})"
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def reset(self):
+        with self._lock:
+            self.histograms.clear()
+            self.spans.clear()
+
+    def span(self, name: str, sample_rate: float=None):
+        if not self.enabled:
+            return _NULL_SPAN
+        rate = self.sample_rate if sample_rate is None else sample_rate
+        if rate < 1 and random() >= rate:
+            return _NULL_SPAN
+        return _Span(self, name, 1 / rate)
+
+    def profile(self, name: str=None, sample_rate: float=None) -> Callable:
+        """
+        decorator timing every call of a function (or coroutine function) as a span named after its qualname
+        func is returned as it is if the profiler is disabled at decoration time
+        """
+        def decorator(func):
+            if not self.enabled:
+                return func
+            span_name = name or func.__qualname__
+
+            if inspect.iscoroutinefunction(func):
+                @wraps(func)
+                async def async_wrapper(*args, **kwargs):
+                    with self.span(span_name, sample_rate):
+                        return await func(*args, **kwargs)
+                return async_wrapper
+
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                # same as self.span(), inlined so that skipped calls do not pay for a context manager
+                if not self.enabled:
+                    return func(*args, **kwargs)
+                rate = self.sample_rate if sample_rate is None else sample_rate
+                if rate < 1 and random() >= rate:
+                    return func(*args, **kwargs)
+                with _Span(self, span_name, 1 / rate):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def report(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            return {name: histogram.summary() for name, histogram in self.histograms.items()}
+
+    def format_report(self) -> str:
+        lines = [f"{'name':<40} {'calls':>10} {'total ms':>10} {'mean us':>10} {'p50 us':>10} {'p95 us':>10} {'p99 us':>10}"]
+        for name, stats in sorted(self.report().items(), key=lambda item: -item[1]['total_ns']):
+            lines.append(
+                f"{name[:40]:<40} {stats['calls']:>10,} {stats['total_ns'] / 1e6:>10.2f} {stats['mean_ns'] / 1e3:>10.2f} "
+                f"{stats['p50_ns'] / 1e3:>10.2f} {stats['p95_ns'] / 1e3:>10.2f} {stats['p99_ns'] / 1e3:>10.2f}"
+            )
+        return '\n'.join(lines)
+
+    def export_jsonl(self, file: Union[str, IO]):
+        """
+        one span per line: name, id, parent, start_ns (from the profiler creation), duration_ns, thread, task
+        """
+        with _open(file) as f:
+            for record in list(self.spans):
+                f.write(json.dumps(record) + '\n')
+
+    def export_chrome_trace(self, file: Union[str, IO]):
+        """
+        Trace Event Format ('X' complete events), spans of an asyncio task are shown on a row of their own
+        """
+        pid = os.getpid()
+        events = [
+            {
+                'name': record['name'], 'ph': 'X', 'pid': pid,
+                'tid': record['task'] or record['thread'],
+                'ts': record['start_ns'] / 1e3, 'dur': record['duration_ns'] / 1e3,
+                'args': {'id': record['id'], 'parent': record['parent']},
+            }
+            for record in list(self.spans)
+        ]
+        with _open(file) as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ns'}, f)
+
+    def _record(self, span: _Span, end: int):
+        record = {
+            'name': span.name, 'id': span.id, 'parent': span.parent,
+            'start_ns': span.start - self.origin, 'duration_ns': end - span.start,
+            'thread': threading.get_ident(), 'task': _task_id(),
+        }
+        with self._lock:
+            self.histograms[span.name].add(end - span.start, span.weight)
+            self.spans.append(record)
+
+
+def _task_id():
+    if asyncio._get_running_loop() is None:  # current_task() raises outside a loop, which is slow
+        return None
+    task = asyncio.current_task()
+    return id(task) if task else None
+
+
+@contextmanager
+def _open(file: Union[str, IO]):
+    if isinstance(file, (str, os.PathLike)):
+        with open(file, 'w') as f:
+            yield f
+    else:
+        yield file
+
+
+profiler = Profiler()
+
+
+class _Counter:
+    """
+    (items, bytes) counter of one process, thread-safe
+    """
+    def __init__(self):
+        self._values = [0, 0]
+        self._lock = threading.Lock()
+
+    def add(self, n: int=1, nbytes: int=0):
+        with self._lock:
+            self._values[0] += n
+            self._values[1] += nbytes
+
+    def values(self) -> Tuple[int, int]:
+        with self._lock:
+            return self._values[0], self._values[1]
+
+    def reset(self):
+        with self._lock:
+            self._values = [0, 0]
+
+
+class SharedCounter(_Counter):
+    """
+    (items, bytes) counter in shared memory, pass it to worker processes through Process args or a Pool initializer
+    """
+    def __init__(self, context: str=None):
+        self._values = multiprocessing.get_context(context).Array('q', 2)
+        self._lock = self._values.get_lock()
+
+    def values(self) -> Tuple[int, int]:
+        with self._lock:
+            return tuple(self._values)
+
+    def reset(self):
+        with self._lock:
+            self._values[:] = [0, 0]
+
+
+class Progress:
+    """
+    progress of a (multi-stage) job with rates smoothed by an exponentially weighted moving average
+
+    - rate / byte_rate: items/s and bytes/s, every TICK seconds or more the rate since the previous tick is weighed in
+      by 1 - 0.5 ** (seconds / half_life), so a slow warm-up stops counting after a few half-lives
+    - stages: {name: weight} in order, remaining stages are estimated from the seconds per weight seen so far
+    - update() is thread-safe, with shared=True the counter lives in shared memory (see SharedCounter)
+      and worker processes update `progress.counter` directly, use watch() to render from a background thread
+    - rendering calls `render` at most every render_interval seconds (None for no rendering)
+    - remaining / eta are None until they can be estimated
+
+    Example:
+
+        progress = Progress(stages={'load': 1, 'transform': 4})
+        progress.start('load', total=len(paths))
+        for path in progress.track(paths):
+            ...
+        progress.start('transform', total=len(frame))
+        for batch in progress.track(PandasIterator(frame, batch_size=1000), size=len):
+            ...
+    """
+    TICK = 0.2
+
+    def __init__(
+        self,
+        total: int=None,
+        total_bytes: int=None,
+        name: str='progress',
+        stages: Dict[str, float]=None,
+        half_life: float=5.,
+        render_interval: float=1.,
+        render: Callable[[str], None]=print,
+        shared: bool=False,
+    ):
+        self.name = name
+        self.stages = dict(stages or {name: 1})
+        self.half_life = half_life
+        self.render_interval = render_interval
+        self.render = render
+        self.counter = SharedCounter() if shared else _Counter()
+        self.started = time.monotonic()
+        self._stage_seconds: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        self._last_render = self.started
+        self.stage = None
+        self.start(next(iter(self.stages)), total, total_bytes)
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.format()})"
+
+    def start(self, stage: str, total: int=None, total_bytes: int=None):
+        """
+        finishes the current stage (if any) and starts `stage`, counts and rates are reset
+        """
+        assert stage in self.stages, f"Unknown stage: {stage!r} (available {'|'.join(self.stages)})"
+        now = time.monotonic()
+        with self._lock:
+            if self.stage is not None and self.stage != stage:
+                self._stage_seconds[self.stage] = now - self.stage_started
+            self.stage = stage
+            self.stage_started = now
+            self.total = total
+            self.total_bytes = total_bytes
+            self.counter.reset()
+            self.rate = self.byte_rate = None
+            self._last_tick, self._last_values = now, (0, 0)
+
+    def update(self, n: int=1, nbytes: int=0):
+        self.counter.add(n, nbytes)
+        now = time.monotonic()
+        if now - self._last_tick >= self.TICK:
+            self.refresh(now)
+
+    def refresh(self, now: float=None):
+        """
+        weighs the rates since the previous tick in and renders if due, update() calls it every TICK seconds
+        """
+        now = now or time.monotonic()
+        with self._lock:
+            seconds = now - self._last_tick
+            if seconds <= 0:
+                return
+            values = self.counter.values()
+            alpha = 1 - 0.5 ** (seconds / self.half_life)
+            rates = [(value - last) / seconds for value, last in zip(values, self._last_values)]
+            if self.rate is None:
+                self.rate, self.byte_rate = rates
+            else:
+                self.rate += alpha * (rates[0] - self.rate)
+                self.byte_rate += alpha * (rates[1] - self.byte_rate)
+            self._last_tick, self._last_values = now, values
+            due = self.render is not None and now - self._last_render >= self.render_interval
+            if due:
+                self._last_render = now
+        if due:
+            self.render(self.format())
+
+    @property
+    def count(self) -> int:
+        return self.counter.values()[0]
+
+    @property
+    def nbytes(self) -> int:
+        return self.counter.values()[1]
+
+    @property
+    def fraction(self) -> Optional[float]:
+        count, nbytes = self.counter.values()
+        if self.total:
+            return min(count / self.total, 1.)
+        if self.total_bytes:
+            return min(nbytes / self.total_bytes, 1.)
+        return None
+
+    @property
+    def remaining(self) -> Optional[timedelta]:
+        """
+        remaining time of the current stage
+        """
+        count, nbytes = self.counter.values()
+        if self.total and self.rate:
+            return timedelta(seconds=max(self.total - count, 0) / self.rate)
+        if self.total_bytes and self.byte_rate:
+            return timedelta(seconds=max(self.total_bytes - nbytes, 0) / self.byte_rate)
+        return None
+
+    @property
+    def overall_remaining(self) -> Optional[timedelta]:
+        """
+        remaining time of the current and the following stages
+        """
+        remaining = self.remaining
+        if remaining is None:
+            return None
+        names = list(self.stages)
+        following = names[names.index(self.stage) + 1:]
+        if self._stage_seconds:
+            seconds_per_weight = sum(self._stage_seconds.values()) / sum(self.stages[name] for name in self._stage_seconds)
+        else:
+            stage_seconds = time.monotonic() - self.stage_started + remaining.total_seconds()
+            seconds_per_weight = stage_seconds / self.stages[self.stage]
+        return remaining + timedelta(seconds=seconds_per_weight * sum(self.stages[name] for name in following))
+
+    @property
+    def eta(self) -> Optional[datetime]:
+        remaining = self.overall_remaining
+        return None if remaining is None else datetime.now() + remaining
+
+    def format(self) -> str:
+        count, nbytes = self.counter.values()
+        parts = [f"[{self.name}]"]
+        if len(self.stages) > 1:
+            parts.append(f"{self.stage} ({list(self.stages).index(self.stage) + 1}/{len(self.stages)})")
+        parts.append(f"{count:,}" + (f"/{self.total:,}" if self.total else ''))
+        if self.fraction is not None:
+            parts.append(f"({self.fraction:.1%})")
+        if self.rate is not None:
+            parts.append(f"{self.rate:,.1f} it/s")
+        if nbytes and self.byte_rate is not None:
+            parts.append(f"{_format_bytes(self.byte_rate)}/s")
+        remaining, overall = self.remaining, self.overall_remaining
+        if remaining is not None:
+            parts.append(f"ETA {_format_timedelta(remaining)}")
+            if len(self.stages) > 1:
+                parts.append(f"(overall {_format_timedelta(overall)})")
+        return ' '.join(parts)
+
+    def track(self, iterable: Iterable, size: Callable=None, nbytes: Callable=None) -> Iterator:
+        """
+        yields the items of iterable and counts them once they are processed (when the next one is asked for)
+
+        - size: items per element, e.g. len for batches of PandasIterator, PopIterator or utils.common.iter_batches
+        - nbytes: bytes per element
+        - the total of the stage is taken from len(iterable) when it is not set and size is None
+
+        counts are kept locally and flushed every `step` elements, step is adapted to flush about every 10 ms
+        """
+        if self.total is None and size is None and hasattr(iterable, '__len__'):
+            self.total = len(iterable)
+        step, pending, count, byte_count = 1, 0, 0, 0
+        flushed = time.perf_counter()
+        try:
+            for item in iterable:
+                yield item
+                count += 1 if size is None else size(item)
+                if nbytes is not None:
+                    byte_count += nbytes(item)
+                pending += 1
+                if pending >= step:
+                    self.update(count, byte_count)
+                    pending = count = byte_count = 0
+                    now = time.perf_counter()
+                    step = step * 2 if now - flushed < 0.01 else max(step // 2, 1) if now - flushed > 0.1 else step
+                    flushed = now
+        finally:
+            self.update(count, byte_count)
+
+    @contextmanager
+    def watch(self):
+        """
+        refreshes and renders from a daemon thread, for updates that come from other processes
+        """
+        stop = threading.Event()
+
+        def run():
+            while not stop.wait(min(self.TICK, self.render_interval)):
+                self.refresh()
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        try:
+            yield self
+        finally:
+            stop.set()
+            thread.join()
+            self.refresh()
+            if self.render is not None:
+                self.render(self.format())
+
+
+def _format_bytes(n: float) -> str:
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if abs(n) < 1024:
+            return f"{n:.1f} {unit}"
+        n /= 1024
+    return f"{n:.1f} TB"
+
+
+def _format_timedelta(delta: timedelta) -> str:
+    return str(timedelta(seconds=round(delta.total_seconds())))
+
+
+if __name__ == "__main__":
+    import io
+    import statistics
+    from concurrent.futures import ThreadPoolExecutor
+
+    histogram = Histogram()
+    for ns in range(1, 100001):
+        histogram.add(ns)
+    assert all(abs(histogram.percentile(q) - q * 1000) / (q * 1000) < 1 / Histogram.SUB_BUCKETS for q in (50, 95, 99))
+
+    prof = Profiler()
+
+    @prof.profile()
+    def leaf():
+        time.sleep(0.001)
+
+    @prof.profile()
+    async def task(n):
+        with prof.span('task.body'):
+            await asyncio.sleep(0.001)
+            leaf()
+
+    async def main():
+        await asyncio.gather(*(task(n) for n in range(10)))
+
+    with prof.span('root'):
+        asyncio.run(main())
+        with ThreadPoolExecutor(4) as pool:
+            list(pool.map(lambda _: leaf(), range(8)))
+
+    spans = {record['id']: record for record in prof.spans}
+    by_name = defaultdict(list)
+    for record in spans.values():
+        by_name[record['name']].append(record)
+    root = by_name['root'][0]
+    assert all(spans[record['parent']]['name'] == 'task.body' for record in by_name['leaf'] if record['task'])
+    assert all(spans[spans[record['parent']]['parent']]['name'].endswith('task') for record in by_name['leaf'] if record['task'])
+    assert len({record['task'] for record in by_name['task.body']}) == 10  # one row per asyncio task
+    assert prof.report()['leaf']['count'] == 18 and root['parent'] is None
+
+    jsonl, trace = io.StringIO(), io.StringIO()
+    prof.export_jsonl(jsonl)
+    prof.export_chrome_trace(trace)
+    assert len(jsonl.getvalue().splitlines()) == len(prof.spans) == len(json.loads(trace.getvalue())['traceEvents'])
+
+    sampled = Profiler(sample_rate=0.01)
+    for _ in range(100000):
+        with sampled.span('hot'):
+            pass
+    stats = sampled.report()['hot']
+    assert 500 < stats['count'] < 1500 and 80000 < stats['calls'] < 120000
+    print(prof.format_report())
+
+    def overhead(func, n=10 ** 6, repeat=5):
+        timings = []
+        for _ in range(repeat):
+            ts = time.perf_counter_ns()
+            for _ in range(n):
+                func()
+            timings.append((time.perf_counter_ns() - ts) / n)
+        return statistics.median(timings)
+
+    def bare():
+        pass
+
+    bench = Profiler()
+    baseline = overhead(bare)
+    print(f"bare call: {baseline:,.0f} ns")
+    assert Profiler(enabled=False).profile()(bare) is bare  # decorated while disabled: no wrapper, no cost
+    profiled = bench.profile()(bare)
+    for enabled, sample_rate in [(False, 1.), (True, 0.01), (True, 1.)]:
+        bench.enabled, bench.sample_rate = enabled, sample_rate
+
+        def with_span():
+            with bench.span('bare'):
+                pass
+
+        print(f"enabled={enabled!s:>5}, sample_rate={sample_rate:>4}: "
+              f"@profile +{overhead(profiled, n=10 ** 5 if enabled and sample_rate == 1 else 10 ** 6) - baseline:,.0f} ns, "
+              f"span +{overhead(with_span, n=10 ** 5 if enabled and sample_rate == 1 else 10 ** 6) - baseline:,.0f} ns per call")
+
+    assert ETA(10)(0) is None
+
+    # warm-up at 100 items/s then 1000 items/s: the smoothed rate follows, the simple average lags
+    clock = [0.]
+    time_monotonic, time.monotonic = time.monotonic, lambda: clock[0]
+    rendered = []
+    progress = Progress(total=100000, half_life=1., render=rendered.append)
+    for second in range(10):
+        for _ in range(10):
+            clock[0] += 0.1
+            progress.update(10 if second < 3 else 100)
+    assert 900 < progress.rate <= 1000 and progress.count / clock[0] < 750 and len(rendered) <= 10  # 100 updates, one render per second
+    assert abs(progress.remaining.total_seconds() - (100000 - progress.count) / progress.rate) < 1e-6
+
+    progress = Progress(stages={'load': 1, 'transform': 3}, render=None)
+    progress.start('load', total=100)
+    clock[0] += 10
+    progress.update(100)
+    progress.start('transform', total=1000)
+    for _ in range(5):
+        clock[0] += 1
+        progress.update(100)
+    assert progress.remaining.total_seconds() == 5 and progress.overall_remaining.total_seconds() == 5
+    time.monotonic = time_monotonic
+
+    progress = Progress(render=None)
+    with ThreadPoolExecutor(8) as pool:
+        list(pool.map(lambda _: [progress.update(1, 10) for _ in range(10000)], range(8)))
+    assert (progress.count, progress.nbytes) == (80000, 800000)
+
+    def work(counter, n):
+        for _ in range(n):
+            counter.add(10)
+
+    progress = Progress(total=4 * 1000 * 10, shared=True, render=None)
+    workers = [multiprocessing.Process(target=work, args=(progress.counter, 1000)) for _ in range(4)]
+    with progress.watch():
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+    assert progress.count == 40000 and progress.fraction == 1.
+
+    n_items = 10 ** 6
+    items = range(n_items)
+    ts = time.perf_counter()
+    for _ in items:
+        pass
+    bare = (time.perf_counter() - ts) / n_items
+    progress = Progress(render=None)
+    ts = time.perf_counter()
+    for _ in progress.track(items):
+        pass
+    tracked = (time.perf_counter() - ts) / n_items
+    assert progress.count == progress.total == n_items
+    print(f"Progress.track: +{(tracked - bare) * 1e9:.0f} ns per item, {progress.format()}")